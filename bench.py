@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+## Thanks to those who came before us
+import os
+import sys
+import json
+import time
+import random
+import datetime
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import biograph
+
+## Synthetic blueprints
+memory_mix = dict(          # Share of each nature of memory in a synthetic blueprint
+    home=0.1,
+    event=0.2,
+    roommate=0.1,
+    weekday=0.4,
+    weekend=0.2
+)
+weekday_types = ['school', 'work', 'love', 'friend', 'project', 'play']
+weekend_types = ['play', 'project', 'friend', 'love']
+
+def synthetic_blueprint(fn_tsv, rows=1000, years=70, mix=memory_mix, seed=0):
+    '''Writes a blueprint.tsv of a timespan of years years and rows random memories, drawn from mix.
+    The same seed always gives the same blueprint.'''
+
+    rng = random.Random(seed)
+    natures = list(mix)
+    weights = [mix[nature] for nature in natures]
+
+    end = datetime.date(2020, 1, 1).toordinal()
+    start = end - int(years * 365.25)
+    isodate = lambda ordinal: datetime.date.fromordinal(ordinal).isoformat()
+
+    with open(fn_tsv, 'w', encoding='utf-8') as fp:
+        fp.write('\t'.join(biograph.headers) + '\n')
+        fp.write('\t'.join(['timespan', '', '', isodate(start), isodate(end)] + ['']*7) + '\n')
+
+        for i in range(rows):
+            nature = rng.choices(natures, weights)[0]
+            first = rng.randint(start, end - 1)
+            last = rng.randint(first + 1, min(end, first + 3650))
+            row = [nature, '', 'memory %d' % (i % 100), isodate(first), isodate(last)] + ['']*7
+
+            if nature == 'event':
+                row[4] = isodate(min(end, first + rng.randint(0, 7)))
+            elif nature == 'roommate':
+                row[1] = str(rng.randint(1, 3))
+                row[10] = str(rng.randint(0, 3))
+            elif nature == 'weekday':
+                row[0] = rng.choice(weekday_types)
+                row[1] = str(rng.randint(1, 3))
+                start_hour = rng.randint(7, 20)
+                row[5] = str(start_hour)
+                row[6] = str(rng.randint(start_hour + 1, 24))
+            elif nature == 'weekend':
+                row[0] = rng.choice(weekend_types)
+                row[1] = str(rng.randint(1, 3))
+                row[7] = str(rng.choice([1, 2.5, 7, 10]))
+                row[10] = str(rng.randint(0, 4))
+
+            fp.write('\t'.join(row) + '\n')
+
+## Timing
+modes = ['rows', 'numpy', 'stream']     # per-row drawing as make_bio() blueprints do, vectorized layout, streamed svg
+
+def time_render(fn_tsv, fn_svg, mode):
+    '''Draws fn_tsv into fn_svg once, timing the phases of tsv_to_svg() separately:
+    ingest (reading and parsing rows), layout (drawing them into the svg) and serialize (dwg.save()).
+    When streaming, most of the serializing already happens during layout.
+    Returns a dict of seconds per phase.'''
+
+    bio = biograph.Biograph()
+
+    start = time.perf_counter()
+    memories = [biograph.parse_memory(fields) for fields in biograph.read_tsv(fn_tsv)]
+    ingested = time.perf_counter()
+
+    bio.setup_dwg(fn_svg, stream=(mode == 'stream'))
+    bio.draw_rows(memories, vectorized=(mode == 'numpy'))
+    laid_out = time.perf_counter()
+
+    bio.dwg.save()
+    saved = time.perf_counter()
+
+    return dict(ingest=ingested - start, layout=laid_out - ingested, serialize=saved - laid_out)
+
+def run_case(rows, years, mode, repeat, mix=memory_mix, seed=0):
+    'Times a synthetic blueprint of rows memories repeat times; returns the min and median of every phase.'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fn_tsv = os.path.join(tmp, 'blueprint.tsv')
+        fn_svg = os.path.join(tmp, 'biograph.svg')
+        synthetic_blueprint(fn_tsv, rows, years, mix, seed)
+
+        runs = [time_render(fn_tsv, fn_svg, mode) for i in range(repeat)]
+        svg_bytes = os.path.getsize(fn_svg)
+
+    phases = {}
+    for phase in ['ingest', 'layout', 'serialize']:
+        seconds = [run[phase] for run in runs]
+        phases[phase] = dict(min=min(seconds), median=statistics.median(seconds))
+    total = [sum(run.values()) for run in runs]
+    phases['total'] = dict(min=min(total), median=statistics.median(total))
+
+    return dict(rows=rows, years=years, mode=mode, repeat=repeat, svg_bytes=svg_bytes, phases=phases)
+
+def run_suite(row_counts, years=70, modes=modes, repeat=5, mix=memory_mix, seed=0):
+    'Times every combination of row count and mode; returns the results as a json-able dict.'
+
+    cases = {}
+    for rows in row_counts:
+        for mode in modes:
+            name = '%s-%d' % (mode, rows)
+            cases[name] = run_case(rows, years, mode, repeat, mix, seed)
+            print('%-14s %s' % (name, '  '.join('%s %.4fs' % (phase, t['median']) for phase, t in cases[name]['phases'].items())), file=sys.stderr)
+
+    return dict(
+        date=datetime.datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        mix=mix,
+        cases=cases
+    )
+
+## Import time
+import_budget = 0.030       # Seconds that importing biograph may add to starting python
+
+def time_import(repeat=10):
+    '''Times importing biograph in fresh interpreters, less the start of a bare interpreter.
+    A first run writes the bytecode, as installing would. Returns the min and median seconds.'''
+
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=here, env=env, check=True)
+        return time.perf_counter() - start
+
+    run('import biograph')
+    bare = min(run('pass') for i in range(repeat))
+    seconds = [run('import biograph') - bare for i in range(repeat)]
+    return dict(min=min(seconds), median=statistics.median(seconds))
+
+## Cached replays
+replay_blueprint = '''import sys
+from biograph import *
+
+def replayed():
+    timespan('2000-01-01', '2010-01-01', year_height=90.5, pack_slots=True, cluster_events=6)
+    roommate(2, 'Ann', '2001-01-01', '2003-06-01')
+    roommate(2, 'Bea', '2002-01-01', '2004-01-01')
+    play(2, 'Chess', '2002-01-01', '2004-01-01', hours=10)
+    work(2, 'Office', '2001-03-01', '2008-01-01', 9, 17)
+    event('Moved', '2003-02-01', '2003-02-01')
+    event('Married', '2003-02-02', '2003-02-02')
+
+make_bio(replayed, sys.argv[1:])
+'''
+
+def check_replay():
+    '''Draws a Python blueprint twice, first running it and then replaying its cached records (see biograph.compiled_blueprint()).
+    Returns whether both svgs are the same, byte for byte.'''
+
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'replayed.py'), 'w') as fp:
+            fp.write(replay_blueprint)
+        svgs = []
+        for name in ['run.svg', 'replay.svg']:
+            subprocess.run([sys.executable, 'replayed.py', '-o', name], cwd=tmp, env=env, check=True, stdout=subprocess.DEVNULL)
+            with open(os.path.join(tmp, name), 'rb') as fp:
+                svgs.append(fp.read())
+        return os.listdir(os.path.join(tmp, '__pycache__')) != [] and svgs[0] == svgs[1]
+
+## Baselines
+def compare(results, baseline, tolerance=0.1, noise=0.001):
+    '''Compares the median phase timings of results against those of a baseline run.
+    A phase regresses when it is more than tolerance slower, and slower by more than noise seconds.
+    Returns a list of (case, phase, baseline seconds, seconds) regressions.'''
+
+    regressions = []
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for phase, t in case['phases'].items():
+            before = baseline['cases'][name]['phases'][phase]['median']
+            after = t['median']
+            if after > before * (1 + tolerance) and after - before > noise:
+                regressions.append((name, phase, before, after))
+
+    return regressions
+
+## Command line
+def main():
+    '''Times synthetic blueprints of several sizes and writes the results as json (-o, or stdout).
+    With -b, compares them against a baseline results file. Exits with 1 on regressions,
+    if importing biograph takes longer than import_budget, or if a cached Python blueprint draws otherwise than run.'''
+
+    parser = argparse.ArgumentParser(description='biograph benchmarks')
+
+    parser.add_argument('-r', dest='rows', default=[1000, 10000], help='number of memories per blueprint', type=int, nargs='+')
+    parser.add_argument('-y', dest='years', default=70, help='number of years the blueprints span', type=int)
+    parser.add_argument('-m', dest='modes', default=modes, help='drawing modes to time', choices=modes, nargs='+')
+    parser.add_argument('-x', dest='mix', default=[], help='share of a nature of memory, e.g. weekday=0.5', nargs='+')
+    parser.add_argument('-n', dest='repeat', default=5, help='number of times each blueprint is drawn', type=int)
+    parser.add_argument('-o', dest='output', default='', help='output json file')
+    parser.add_argument('-b', dest='baseline', default='', help='baseline json file to compare against')
+    parser.add_argument('--tolerance', dest='tolerance', default=0.1, help='allowed slowdown against the baseline', type=float)
+
+    args = parser.parse_args()
+
+    mix = dict(memory_mix)
+    for share in args.mix:
+        nature, weight = share.split('=')
+        assert nature in memory_mix, nature
+        mix[nature] = float(weight)
+
+    results = run_suite(args.rows, args.years, args.modes, args.repeat, mix)
+    results['cases']['import'] = dict(phases={'import': time_import()})
+    import_seconds = results['cases']['import']['phases']['import']['median']
+    print('%-14s import %.4fs (budget %.4fs)' % ('import', import_seconds, import_budget), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for name, phase, before, after in regressions:
+            print('%s %s regressed: %.4fs -> %.4fs (%+.0f%%)' % (name, phase, before, after, 100 * (after / before - 1)), file=sys.stderr)
+    else:
+        regressions = []
+
+    if import_seconds > import_budget:
+        print('importing biograph takes %.4fs, over the budget of %.4fs' % (import_seconds, import_budget), file=sys.stderr)
+    replayed = check_replay()
+    if not replayed:
+        print('a Python blueprint replayed from its cache draws otherwise than when run', file=sys.stderr)
+    sys.exit(1 if regressions or import_seconds > import_budget or not replayed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 
 ## Thanks to those who came before us
+# Only what drawing a biograph always needs is imported up front. svgwrite, dateutil and the modules of
+# the command line, server, batches, binary blueprints and other outputs are imported where they are used.
+import io
+import os
 import sys
-import svgwrite
-import json
+import time
+import array
+import struct
 import datetime
-import dateutil.parser
-import argparse
-
+import functools
+import itertools
+import bisect
+import heapq
+import contextlib
+import threading
+import collections
 
 ## Grid Options
 timeline_options = dict(
                         debug=False,              # if True, prints additional debug output
                         legend=True,             # if False, removes legend
                         private=False,           # if False, censors private information
+                        declutter=False,         # if True, moves, turns or leaves out labels that would overlap
+                        pack_slots=False,        # if True, roommates and weekend memories without a slot get the lowest free one
+                        cluster_events=0,        # if > 0, events closer than this many pixels on the event line are drawn as one
                         top_grid = 100,          # y coordinate of the top grid border
                         left_grid = 50,          # x coordinate of the left grid border
                         right_grid = 1000,       # x coordinate of the right grid border
@@ -23,7 +35,7 @@ timeline_options = dict(
                         weekday_hour_width = 30, # Number of x pixels per hour in a weekday
                         year_height = 52         # Number of y pixels per year
                         )
-
+default_timeline_options = dict(timeline_options)
 
 ## Of Global Importance
 color_palette = {           # Color palette to allocate from
@@ -38,9 +50,8 @@ color_palette = {           # Color palette to allocate from
     'home': 'gray'
 }
 headers = "type   intensity   label   start_date   end_date   weekday_start   weekday_end   weekend_hours   href   title   slot   rest".split()
-residence_colors = {}
-saved_memories = []
-event_colors = {}
+date_cache_size = 4096      # Number of parsed dates each DateAxis remembers
+label_ems = dict(yeartick=1.2, age=1.2, axis_label=1.5, event=1.0)  # Font sizes of label classes in biograph.css, in ems (0.7 otherwise)
 
 ## Helpers
 class TypedAttrDict:
@@ -58,23 +69,24 @@ class TypedAttrDict:
             raise Exception('no such option "%s"' % k)
         self._opts[k] = type(self._opts[k])(v)
 
-def private(s, censored=''):
-    return s if options.private else censored
-
 def mid(p1, p2):
     'Returns the midpoint between p1 and p2.'
 
     return (p1+p2) / 2
 
-def wrap_link(svg_obj, href):
-    'Makes an svg_obj clickable with a link to href.'
+def cluster_runs(positions, threshold):
+    '''Splits sorted positions into runs that each span less than threshold, in one pass.
+    Returns the (first, last) indices of every run, last excluded.'''
 
-    if href:
-        outer = svgwrite.container.Hyperlink(href, target='_blank')
-        outer.add(svg_obj)
-        svg_obj = outer
-
-    return svg_obj
+    runs = []
+    first = 0
+    for i, position in enumerate(positions):
+        if position - positions[first] >= threshold:
+            runs.append((first, i))
+            first = i
+    if positions:
+        runs.append((first, len(positions)))
+    return runs
 
 def add_class(kwargs, cls):
     'Adds a css styling cls to kwargs.'
@@ -84,545 +96,3045 @@ def add_class(kwargs, cls):
     else:
         kwargs['class_'] = cls
 
-def add_obj(parent, svg_obj):
-    'Add svg_obj as a subelement to parent'
+class LabelIndex:
+    '''A grid hash of the boxes of the labels placed so far.
+    Finding the labels a new one would overlap only looks at the cells it covers, instead of at every label.'''
 
-    if not parent:
-        parent = dwg
-    parent.add(svg_obj)
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
 
-def parse_date(isodate):
-    'Returns the y-axis coordinate for an isodate (YYYY-MM-DD).'
+    def cells_of(self, box):
+        x1, y1, x2, y2 = box
+        c = self.cell_size
+        return [(i, j) for i in range(int(x1 // c), int(x2 // c) + 1) for j in range(int(y1 // c), int(y2 // c) + 1)]
 
-    parsed_date = dateutil.parser.parse(isodate)
-    days_alive = (top_date - bottom_date).days # Total days alive
-    day_count = (top_date - parsed_date).days # Number of days into life at which event occurred
-    scale = (options.bottom_grid-top_grid) / days_alive
-    return options.bottom_grid - scale*(days_alive-day_count)
+    def overlaps(self, box):
+        'Returns whether box overlaps any of the boxes added so far.'
 
-def width_from_hours(num_days, num_hours):
-    'Given total num_hours spent over num_days, returns the width in pixels'
+        x1, y1, x2, y2 = box
+        for cell in self.cells_of(box):
+            for b in self.cells.get(cell, ()):
+                if b[0] < x2 and x1 < b[2] and b[1] < y2 and y1 < b[3]:
+                    return True
+        return False
 
-    # Input Quality
-    assert num_hours <= (num_days*16)
+    def add(self, box):
+        for cell in self.cells_of(box):
+            self.cells[cell].append(box)
 
-    options.weekday_hour_width = weekday_hour(10) - weekday_hour(9)
-    return  (num_hours/260) * options.weekday_hour_width / (num_days/365)
+@functools.lru_cache(maxsize=1)
+def source_digest():
+    'Returns the sha256 digest of biograph.py, standing in for a version: caches drawn by another biograph.py are not reused.'
 
-def weekday_hour(hr):
-    'Returns the x-axis coordinate for a weekday time.'
+    import hashlib
+    with open(__file__, 'rb') as fp:
+        return hashlib.sha256(fp.read()).digest()
 
-    x_scale = (weekday_right_grid-weekday_left_grid) / (options.weekday_end_hour-options.weekday_start_hour)
-    return weekday_left_grid + (hr-options.weekday_start_hour) * x_scale
+def isodate_ordinal(isodate):
+    'Returns the day ordinal of a strict isodate (YYYY-MM-DD), or None for any other text: the fast path of every date parsed.'
 
+    if len(isodate) == 10 and isodate[4] == '-' and isodate[7] == '-' and isodate.isascii() and (isodate[:4] + isodate[5:7] + isodate[8:]).isdigit():
+        try:
+            return datetime.date(int(isodate[:4]), int(isodate[5:7]), int(isodate[8:])).toordinal()
+        except ValueError:
+            pass
+    return None
 
-## Pencil strokes
-def text(x, y, label, align=None, parent=None, href=None, **kwargs):
-    '''Draws label at (x,y).
-    font_size is in ems.
-    Optionally, label can link to href.'''
+def parse_datetime(isodate):
+    'Returns the datetime of isodate (YYYY-MM-DD). Only non-ISO dates go through dateutil.'
 
-    # Coordinates
-    x,y = int(x),int(y)
+    ordinal = isodate_ordinal(isodate)
+    if ordinal is not None:
+        return datetime.datetime.fromordinal(ordinal)
+    import dateutil.parser
+    return dateutil.parser.parse(isodate)
 
-    # Drawing
-    if align is not None:
-        add_class(kwargs, align)
-    p = dwg.g(**kwargs)
-    t = dwg.text(str(label), x = [x+3], y = [y])
-    p.add(wrap_link(t, href))
-    add_obj(parent, p)
+class DateAxis:
+    '''Transforms dates into y-axis coordinates between bottom_date and top_date.
+    Built once per timespan; parsed dates are remembered as day ordinals.'''
 
-def text_left(x1, y1, x2, y2, label, font_size=0.7, align='middle', parent=None, href=None, **kwargs):
-    '''Draws label at coordinate x1, in between coordinates y1 to y2.
-    font_size is in ems.
-    Optionally, label can link to href.'''
+    def __init__(self, bottom_date, top_date, top_y, bottom_y, cache_size=date_cache_size):
+        self.top_date = top_date
+        self.top_ordinal = top_date.toordinal()
+        self.days_alive = (top_date - bottom_date).days # Total days alive
+        self.bottom_y = bottom_y
+        self.scale = (bottom_y-top_y) / self.days_alive
+        self.ordinal = functools.lru_cache(maxsize=cache_size)(self._ordinal)
 
-    x = x1
-    y = mid(y1, y2) + 10
-    text(x, y, label, None, parent, href, **kwargs)
-
-def text_center(x1, y1, x2, y2, label, align='middle', parent=None, href=None, **kwargs):
-    '''Draws label in the center of coordinates (x1, y1) to (x2, y2).
-    font_size is in ems.
-    Optionally, label can link to href.'''
-
-    x = mid(x1, x2-underhang_offset)
-    y = mid(y1, y2)+underhang_offset
-    if abs(y2-y1) > abs(x2-x1) and len(label)*10 > abs(x2-x1):
-        add_class(kwargs, 'vert')
-    text(x, y, label, align, parent, href, **kwargs)
-
-def line(x1, y1, x2, y2, color='grey'):
-    'Draws a colored line from (x1, y1) to (x2, y2).'
-
-    # Coordinates
-    x1,y1,x2,y2 = int(x1),int(y1),int(x2),int(y2)
-
-    # Drawing
-    dwg.add(dwg.line((x1, y1), (x2, y2), stroke=color))
-
-def rectangle(x1, y1, x2, y2, href=None, title=None, parent=None, color='rectangle', **kwargs):
-    '''Draws a rectangle from coordinates (x1, y1) to (x2, y2).
-    **kwargs: css styling.'''
-
-    # Coordinates
-    x1,y1,x2,y2 = int(x1),int(y1),int(x2),int(y2)
-    points = [(x1,y1), (x2,y1), (x2,y2), (x1,y2)]
-
-    # Drawing
-    add_class(kwargs, color)
-    p = dwg.polygon(points, **kwargs)
-    add_obj(parent, wrap_link(p, href))
-    return p
-
-
-## Where the magic happens
-def occurrence(css_color, label, start_isodate, end_isodate, parent=None, href=None, **kwargs):
-    '''Draws a circle representing short duration events on the event line.
-    Event is centered between start_isodate (YYYY-MM-DD) and end_isodate (YYYY-MM-DD). Size of the circle is proportional to the event duration.'''
-
-    # Input Quality
-    assert start_isodate <= end_isodate, (start_isodate, end_isodate)
-
-    # Coordinates
-    start_date = parse_date(start_isodate)
-    end_date = parse_date(end_isodate)
-    event_midpoint = mid(start_date, end_date)
-    event_radius = 3
-
-    # Drawing
-    add_class(kwargs, css_color)
-    p = dwg.circle((event_line_x, event_midpoint), (event_radius), **kwargs)
-    add_obj(parent, wrap_link(p, href))
-    text(event_line_x + event_radius, event_midpoint+5, label, class_='event', href=href)
-
-def weekday(css_color, label, start_isodate, end_isodate, start_hour, end_hour, **kwargs):
-    '''Draws a weekday event from (start_hour, start_isodate (YYYY-MM-DD)) to (end_hour, end_isodate (YYYY-MM-DD)).
-    **kwargs: optional css styling.'''
-
-    end_isodate = end_isodate or top_isodate
-
-    # Input Quality
-    assert start_isodate < end_isodate, (start_isodate, end_isodate)
-
-    # Coordinates
-    y1 = parse_date(start_isodate)
-    y2 = parse_date(end_isodate)
-    x1 = weekday_hour(start_hour)
-    x2 = weekday_hour(end_hour)
-
-    # Drawing
-    add_class(kwargs, css_color)
-    rectangle(x1, y1, x2, y2, **kwargs)
-    text_center(x1, y1, x2, y2, label, **kwargs)
-
-def sleepmate(css_color, label, start_isodate, end_isodate, slot=0, **kwargs):
-    '''Draws pillow cuddle-friends you had from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).
-    There are four available slots for 4 home-mates. You can indicate which one you want occupied by setting slot to 0-3.
-    **kwargs: optional css styling.'''
-
-    end_isodate = end_isodate or top_isodate
-
-    # Input Quality
-    assert start_isodate < end_isodate
-    roommate_width = width_from_hours(7, 2)
-    # Coordinates
-    y1 = parse_date(start_isodate)
-    y2 = parse_date(end_isodate)
-    x1 = weekday_left_grid - (roommate_width*(slot)+15)
-    x2 = x1 + roommate_width
-
-    # Drawing
-    add_class(kwargs, css_color)
-    rectangle(x1, y1, x2, y2, **kwargs)
-    text_center(x1, y1, x2, y2, label, **kwargs)
-
-def weekend(css_color, label, start_isodate, end_isodate, hours_per_week, slot=0, **kwargs):
-    '''Draws a weekend event from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).
-    Width of the drawing is proportional to the hours_per_week invested.
-    **kwargs: optional css styling.'''
-
-    end_isodate = end_isodate or top_isodate
-    # Input Quality
-    assert start_isodate < end_isodate
-
-    if slot < 0:
-        slot = 0
-    elif slot > 4:
-        slot = 4
-
-    # Coordinates
-    start_date = dateutil.parser.parse(start_isodate)
-    end_date = dateutil.parser.parse(end_isodate)
-    num_days = (end_date - start_date).days
-    num_hours = hours_per_week * num_days / 7
-
-    y1 = parse_date(start_isodate)
-    y2 = parse_date(end_isodate)
-    x1 = weekday_right_grid + 1 + width_from_hours(2, slot*2)
-    x2 = x1 + width_from_hours(num_days, num_hours)
-
-    # Drawing
-    add_class(kwargs, css_color)
-    rectangle(x1, y1, x2, y2, **kwargs)
-    text_center(x1, y1, x2, y2, label, **kwargs)
-
-
-def residence(css_color, label, start_isodate, end_isodate, **kwargs):
-    '''Draws a box of y-axis length = duration of stay at a residence.
-    **kwargs: optional css styling.'''
-
-    end_isodate = end_isodate or top_isodate
-
-    # Input Quality
-    assert start_isodate < end_isodate, (start_isodate, end_isodate)
-
-    # Coordinates
-    start_date = parse_date(start_isodate)
-    end_date = parse_date(end_isodate)
-    x1 = options.left_grid
-    y1 = start_date
-    x2 = weekend_right_grid
-    y2 = end_date
-
-    # Drawing
-    add_class(kwargs, css_color)
-    add_class(kwargs, 'residence')
-    rectangle(x1, y1, x2, y2, **kwargs)
-    if label:
-        text_left(options.left_grid, y1-8, weekday_left_grid, y1-15, label,  align='middle')
-
-
-## Canvas
-def timespan(start_isodate, end_isodate, **kwargs):
-    'Draws the histomap grid from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).'
-
-    # Set options
-    timeline_options.update(**kwargs)
-    for k, v in kwargs.items():
-        generic('option', 0, k, v)
-
-    generic('timespan', 0, '', start_isodate, end_isodate)
-
-    # Set dates
-    assert start_isodate < end_isodate
-    global bottom_date,top_date
-    global bottom_isodate,top_isodate
-    top_isodate = end_isodate
-    top_date    = dateutil.parser.parse(end_isodate)     # Final recorded day
-    bottom_date = dateutil.parser.parse(start_isodate)   # First recorded day
-
-    # If year_height is set, it takes priority over bottom_grid
-    if options.year_height is not None:
-        days_alive = (top_date - bottom_date).days
-        num_years = days_alive/365
-        options.bottom_grid = num_years * options.year_height
-
-    # Set the bounds of the viewport such that the entire map can be viewed.
-    dwg.viewbox(width=options.right_grid+150, height=options.bottom_grid+50)
-
-    # Set grid variables
-    global underhang_offset, weekday_left_grid, weekday_right_grid, weekend_right_grid, age_left, age_right, event_line_x, top_grid, top_label_y
-
-    underhang_offset = 5               # ensures text does sit below drawn lines
-    top_grid = options.top_grid
-    top_label_y = top_grid + 5         # y coordinate of where the top labels are placed
-
-    weekday_left_grid = options.left_grid + 250
-    weekday_right_grid = weekday_left_grid + options.weekday_hour_width*(options.weekday_end_hour-options.weekday_start_hour) # Where the weekdays end
-    weekend_right_grid = weekday_right_grid + (32/260 * options.weekday_hour_width / (7/365))                                 # Where the weekends end
-
-    age_left = weekend_right_grid          # x coordinate of where the placement of the ages starts
-    age_right = weekend_right_grid + 35    # x coordinate of the right border for ages
-    event_line_x = weekend_right_grid + 50 # x coordinate of the event line
-
-
-    # Set year ticks on y-axis
-    for y in range(bottom_date.year, top_date.year+1):
-        dt = parse_date('%s-01-01' % y)
-        line(0, dt, options.left_grid, dt)
-        text(0, dt-2, y, class_='yeartick')
-
-    # Set ages on y-axis
-    age = 0
-    for y in range(bottom_date.year, top_date.year):
-        g = svgwrite.container.Group(class_='age')
-        dwg.add(g)
-        dt   = parse_date('%d-%d-%d' % (y, bottom_date.month, bottom_date.day))
-        endt = parse_date('%d-%d-%d' % (y+1, bottom_date.month, bottom_date.day))
-        rectangle(age_left, dt, age_right, endt, parent=g)
-        if age > 0:
-            text_center(age_left, dt, age_right, endt, str(age), parent=g, class_='age')
-        age += 1
-
-
-    # Set labels on horizontal axis
-    # Coordinates
-    morning_start   = weekday_hour(options.weekday_start_hour)
-    afternoon_start = weekday_hour(12)
-    evening_start   = weekday_hour(18)
-    day_end         = weekday_hour(options.weekday_end_hour)
-
-    # Drawing
-    # Monday to Friday
-    label1_y = top_grid-20
-    label2_y = top_grid-4
-    label_y = mid(label1_y, label2_y)
-    text(mid(morning_start, afternoon_start)-50, label1_y, 'weekday', class_="axis_label")
-    text(mid(morning_start, afternoon_start)-50, label2_y, 'mornings', class_="axis_label")
-    text(mid(afternoon_start, evening_start)-50, label1_y, 'weekday', class_="axis_label")
-    text(mid(afternoon_start, evening_start)-50, label2_y, 'afternoons', class_="axis_label")
-    text(mid(evening_start, day_end)-50, label1_y, 'weekday', class_="axis_label")
-    text(mid(evening_start, day_end)-50, label2_y, 'evenings', class_="axis_label")
-    line(morning_start, top_label_y, morning_start-1, top_grid-50)
-    line(afternoon_start, top_label_y, afternoon_start - 1, top_grid-30)
-    line(evening_start, top_label_y, evening_start-1, top_grid-30)
-
-    # Saturday to Sunday
-    text(mid(day_end, weekend_right_grid)-50, label_y, 'weekends', class_="axis_label")
-    line(day_end, top_label_y, day_end, top_grid-50)
-    line(weekend_right_grid-1, top_label_y, weekend_right_grid-1, top_grid-50)
-
-    # ZzzzzzZZZ
-    text(mid(options.left_grid, weekday_left_grid)-125, label_y, 'residences', class_="axis_label")
-    text(morning_start-70, label_y, 'flatmates', class_="axis_label")
-    line(weekday_left_grid, top_label_y, weekday_left_grid, top_grid-50)
-
-    # Legend
-    if options.legend:
-        legend_x1 = mid(options.left_grid, weekday_left_grid)-130
-        legend_x2 = legend_x1 + width_from_hours(150,100)
-        legend_y1 = options.top_grid - 55
-        legend_y2 = legend_y1 + (parse_date('%d-%d-%d' % (top_date.year+1, 5, 30)) - parse_date('%d-%d-%d' % (top_date.year, 12, 28)))
-        rectangle(legend_x1-20, legend_y1+10, legend_x2+55, legend_y2-14, class_='legend')
-        rectangle(legend_x1, legend_y1+3, legend_x2, legend_y2+3, class_="scale")
-        text(legend_x1-15, legend_y2-3, '5 hours/week')
-        text(legend_x2+3, legend_y2+18, '20 weeks')
-        text(legend_x1+3, legend_y1-8, '100')
-        text(legend_x1-1, legend_y1+1, 'hours')
-
-    # Draw the event line
-    text(age_right, label_y, 'events', class_="axis_label")
-    line(event_line_x, top_grid, event_line_x, options.bottom_grid)
-
-    text(weekend_right_grid+20, 15, 'Generated on ' + end_isodate)
-
-## No matter the nature of memories, they all end up here.
-def generic(type, intensity, label, start_isodate, end_isodate=None, weekday_start_hour=None, weekday_end_hour=None, hours=None, **kwargs):
-    'Processes all of the memories and sends them to the appropriate drawer'
-
-    href  = kwargs['href'] if 'href' in kwargs else ''
-    title = kwargs['title'] if 'title' in kwargs else  ''
-    slot  = kwargs['slot'] if 'slot' in kwargs else ''
-    rest  = json.dumps(kwargs) if kwargs else ''
-
-    saved_memories.append(list(str(x or '') for x in [type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, href, title, slot, rest]))
-
-    kwargs.pop('title', None)
-
-    # Do nuffin
-    if type in ['timespan', 'option']:
-        return
+    def _ordinal(self, isodate):
+        'Returns the day ordinal of isodate. Only non-ISO dates go through parse_datetime().'
 
-    # Homes we keep returning to are going to be assigned the same colour
-    if type in ['home']:
-        if label not in residence_colors:
-            residence_colors[label] = color_palette[type] + str(len(residence_colors)+1)
-            color = residence_colors[label]
-        else:
-            color = residence_colors[label]
-            label = ''
-        if 'class_' in kwargs:
-            color = 'blerg'
-        return residence(color, label, start_isodate, end_isodate, **kwargs)
-
-    if type in ['event']:
-        if label not in event_colors:
-            event_colors[label] = color_palette[type] + str(len(event_colors)+1)
-            color = event_colors[label]
-        else:
-            color = event_colors[label]
-            label = ''
-        if 'class_' in kwargs:
-            color = 'blerg'
-        return occurrence(color, label, start_isodate, end_isodate, **kwargs)
-
-    # Weekly
-    color = color_palette[type] + str(intensity)
-    if type in ['roommate']:
-        return sleepmate(color, label, start_isodate, end_isodate or top_isodate, **kwargs)
-    if not hours:
-        return weekday(color, label, start_isodate, end_isodate or top_isodate, weekday_start_hour, weekday_end_hour, **kwargs)
-    else:
-        return weekend(color, label, start_isodate, end_isodate or top_isodate, hours, **kwargs)
+        return isodate_ordinal(isodate) or self.top_ordinal - (self.top_date - parse_datetime(isodate)).days
 
+    def y(self, isodate):
+        'Returns the y-axis coordinate for an isodate (YYYY-MM-DD).'
 
-## The nature of memories
-def event(name, start_isodate, end_isodate, *args, **kwargs):
-    'What were the key events or landmarks in your life?'
-    return generic('event', 0, name, start_isodate, end_isodate, *args, **kwargs)
+        day_count = self.top_ordinal - self.ordinal(isodate) # Number of days into life at which event occurred
+        return self.bottom_y - self.scale*(self.days_alive-day_count)
 
-def school(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'Where did you study?'
-    return generic('school', intensity, name, start_isodate, end_isodate, *args, **kwargs)
 
-def work(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'How have you made a living?'
-    return generic('work', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+## Paper
+def escape_text(s):
+    'Escapes s for use as xml character data.'
 
-def play(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'When were some moments you stepped back and did something without a goal in mind?'
-    return generic('play', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
-def project(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'Which sort of endeavours did you undertake?'
-    return generic('project', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+def escape_attrib(s):
+    'Escapes s for use as an xml attribute value.'
 
-def love(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'With whom have you written a shared story?'
-    return generic('love', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+    return escape_text(s).replace('"', '&quot;').replace('\r', '&#13;').replace('\n', '&#10;').replace('\t', '&#09;')
 
-def friend(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'Who have you met along the way that has made the journey more pleasant.'
-    return generic('friend', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+class SvgElement:
+    '''A bare svg element, serialized exactly like svgwrite does but without its validation.
+    Attribute names follow svgwrite rules: class_ -> class, stroke_width -> stroke-width.'''
 
-def roommate(intensity, name, start_isodate, end_isodate, *args, **kwargs):
-    'With whom have you lived with?'
-    return generic('roommate', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+    __slots__ = ('name', 'attribs', 'elements', 'text')
 
-def home(name, start_isodate, end_isodate, **kwargs):
-    'Where have you lived?'
-    return generic('home', 0, name, start_isodate, end_isodate, **kwargs)
+    def __init__(self, name, text='', **attribs):
+        self.name = name
+        self.attribs = {}
+        self.elements = []
+        self.text = text
+        for k, v in attribs.items():
+            self[k.rstrip('_').replace('_', '-')] = v
 
+    def __setitem__(self, k, v):
+        self.attribs[k] = v
+
+    def add(self, element):
+        self.elements.append(element)
+        return element
+
+    def set_desc(self, title=None, desc=None):
+        'Adds a <title> (tooltip) and <desc> as first children, like svgwrite does.'
+
+        if desc is not None:
+            self.elements.insert(0, SvgElement('desc', desc))
+        if title is not None:
+            self.elements.insert(0, SvgElement('title', title))
+
+    def attribs_string(self):
+        return ''.join(' %s="%s"' % (k, escape_attrib(str(v))) for k, v in sorted(self.attribs.items()) if v is not None and str(v))
+
+    def tostring(self):
+        if not self.text and not self.elements:
+            return '<%s%s />' % (self.name, self.attribs_string())
+        return '<%s%s>%s%s</%s>' % (self.name, self.attribs_string(), escape_text(self.text), ''.join(e.tostring() for e in self.elements), self.name)
+
+class SvgStream:
+    '''Stands in for svgwrite.Drawing, but writes every element to a buffered filename as soon as it is added to the drawing.
+    Memory use stays constant no matter how many memories are drawn.
+    The viewbox and defs must be set before the first element is added.
+    filename can also be an open file, which is left open by save().'''
+
+    def __init__(self, filename, buffering=1<<16, **attribs):
+        self.filename = filename
+        self.buffering = buffering
+        self.fp = None
+        self._stylesheets = []
+        self.defs = SvgElement('defs')
+        self.svg = SvgElement('svg', width='100%', height='100%', baseProfile='full', version='1.1', **attribs)
+        self.svg['xmlns'] = 'http://www.w3.org/2000/svg'
+        self.svg['xmlns:xlink'] = 'http://www.w3.org/1999/xlink'
+        self.svg['xmlns:ev'] = 'http://www.w3.org/2001/xml-events'
+
+    def add_stylesheet(self, href, title, alternate='no', media='screen'):
+        self._stylesheets.append((href, title, alternate, media))
+
+    def viewbox(self, minx=0, miny=0, width=0, height=0):
+        assert self.fp is None, 'viewbox must be set before drawing'
+        self.svg['viewBox'] = '%s,%s,%s,%s' % (minx, miny, width, height)
+
+    def start(self):
+        'Opens filename and writes everything up to the first drawn element.'
+
+        if isinstance(self.filename, str):
+            self.fp = open(self.filename, 'w', encoding='utf-8', buffering=self.buffering)
+        else:
+            self.fp = self.filename
+        self.fp.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+        for stylesheet in self._stylesheets:
+            self.fp.write('<?xml-stylesheet href="%s" type="text/css" title="%s" alternate="%s" media="%s"?>\n' % stylesheet)
+        self.fp.write('<svg%s>' % self.svg.attribs_string())
+        self.fp.write(self.defs.tostring())
 
-## Where the magic begins
-def print_to_tsv(fn):
-    'Constructs a blueprint.tsv file out of biograph function calls.'
+    def add(self, element):
+        if self.fp is None:
+            self.start()
+        self.fp.write(element.tostring())
+        return element
+
+    def save(self):
+        if self.fp is None:
+            self.start()
+        self.fp.write('</svg>')
+        if self.fp is not self.filename:
+            self.fp.close()
+
+    # Element factories, as used from svgwrite.Drawing
+    def g(self, **kwargs):
+        return SvgElement('g', **kwargs)
+
+    def a(self, href, target='_blank', **kwargs):
+        return SvgElement('a', target=target, **{'xlink:href': href}, **kwargs)
+
+    def text(self, text, x, y, **kwargs):
+        return SvgElement('text', text, x=' '.join(map(str, x)), y=' '.join(map(str, y)), **kwargs)
+
+    def line(self, start, end, **kwargs):
+        return SvgElement('line', x1=start[0], y1=start[1], x2=end[0], y2=end[1], **kwargs)
+
+    def polygon(self, points, **kwargs):
+        return SvgElement('polygon', points=' '.join('%s,%s' % p for p in points), **kwargs)
+
+    def circle(self, center, r, **kwargs):
+        return SvgElement('circle', cx=center[0], cy=center[1], r=r, **kwargs)
+
+    def rect(self, insert, size, **kwargs):
+        return SvgElement('rect', x=insert[0], y=insert[1], width=size[0], height=size[1], **kwargs)
+
+    def pattern(self, size, **kwargs):
+        return SvgElement('pattern', width=size[0], height=size[1], **kwargs)
+
+
+class SvgRecorder(SvgStream):
+    'Stands in for svgwrite.Drawing, but only keeps the elements added to it, in order.'
+
+    def __init__(self):
+        super().__init__(None)
+        self.elements = []
+
+    def add(self, element):
+        self.elements.append(element)
+        return element
+
+def element_tree(element):
+    'Returns an SvgElement as a json-able [name, attribs, text, subelements] tree, keeping the types of attributes.'
+
+    return [element.name, element.attribs, element.text, [element_tree(e) for e in element.elements]]
+
+def tree_element(tree):
+    'Returns the SvgElement of a tree given by element_tree().'
+
+    name, attribs, text, elements = tree
+    element = SvgElement(name, text)
+    element.attribs = attribs
+    element.elements = [tree_element(e) for e in elements]
+    return element
+
+class GridCache:
+    '''Keeps the grids that timespan() draws into SvgStream drawings, as lists of SvgElements keyed by timespan and options.
+    The most recently used max_entries grids are kept in memory, and if directory is set, every grid is also kept there on disk,
+    so that other processes need not draw it either. Elements are shared between drawings, so they must not be changed.'''
+
+    def __init__(self, max_entries=64, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(start_isodate, end_isodate, timeline_options):
+        'Returns the key of the grid from start_isodate to end_isodate drawn with timeline_options, by this version of biograph.'
+
+        import json
+        import hashlib
+        h = hashlib.sha256(json.dumps([start_isodate, end_isodate, timeline_options], sort_keys=True, default=str).encode('utf-8'))
+        h.update(source_digest())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, 'grid-%s.json' % key[:32])
+
+    def get(self, key):
+        'Returns the elements of the grid of key, or None if it was not drawn yet.'
+
+        with self.lock:
+            elements = self.entries.get(key)
+            if elements is not None:
+                self.entries.move_to_end(key)
+                return elements
+
+        if self.directory and os.path.exists(self.path(key)):
+            import json
+            with open(self.path(key), encoding='utf-8') as fp:
+                elements = [tree_element(tree) for tree in json.load(fp)]
+            self.keep(key, elements)
+        return elements
+
+    def put(self, key, elements):
+        'Keeps the elements of the grid of key, on disk too if there is a directory. Failing to write to it is not an error.'
+
+        self.keep(key, elements)
+        if self.directory:
+            import json
+            fn = self.path(key)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open('%s.%d.tmp' % (fn, os.getpid()), 'w', encoding='utf-8') as fp:
+                    json.dump([element_tree(e) for e in elements], fp, separators=(',', ':'))
+                os.replace('%s.%d.tmp' % (fn, os.getpid()), fn)
+            except OSError as e:
+                print('grid cache: %s' % e, file=sys.stderr)
 
-    with open(fn, 'w', encoding='utf-8') as fp:
-        fp.write('\t'.join(headers) + '\n')
-        for memory in saved_memories:
-            fp.write('\t'.join(memory) + '\n')
+    def keep(self, key, elements):
+        with self.lock:
+            self.entries[key] = elements
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
 
-def tsv_to_svg(fn_tsv):
-    'Draws a biograph.svg based off of a blueprint.tsv.'
+grid_cache = GridCache()
+
+def draw_patterns(dwg):
+    'Returns the pattern defs of a biograph, drawn with the element factories of dwg.'
+
+    pattern1 = dwg.pattern(size=(20, 20), id="pattern1", patternUnits="userSpaceOnUse")
+    pattern1.add(dwg.rect((0, 0), (20, 20)))
+    pattern1.add(dwg.line((0, 20), (20, 0)))
 
-    memories = open(fn_tsv).readlines()
+    pattern2 = dwg.pattern(size=(8, 8), id="pattern2", patternUnits="userSpaceOnUse")
+    pattern2.add(dwg.rect((0, 0), (8, 8)))
+    pattern2.add(dwg.circle((4, 4), 1))
 
-    # Inspects that the blueprint has the correct structure
-    saved_headers = memories[0][:-1].split('\t')
-    assert saved_headers == headers, saved_headers
+    pattern3 = dwg.pattern(size=(20, 20), id="pattern3", patternUnits="userSpaceOnUse")
+    pattern3.add(dwg.rect((0, 0), (20, 20)))
+    pattern3.add(dwg.line((0, 20), (20, 0)))
+    pattern3.add(dwg.line((0, 0), (20, 20)))
 
-    for memory in memories[1:]:
-        memory = memory[:-1]
-        if options.debug:
-            print(memory)
-        type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, href, title, slot, rest = memory.split('\t')
-        kwargs = {}
+    pattern4 = dwg.pattern(size=(20, 20), id="pattern4", patternUnits="userSpaceOnUse")
+    pattern4.add(dwg.rect((0, 0), (20, 20)))
+    pattern4.add(dwg.line((10, 0), (10, 20)))
 
-        if href:  kwargs['href'] = href
-        if title: kwargs['title'] = title
-        if slot:  kwargs['slot'] = float(slot)
-        if rest:  kwargs.update(json.loads(rest))
+    pattern5 = dwg.pattern(size=(20, 20), id="pattern5", patternUnits="userSpaceOnUse")
+    pattern5.add(dwg.rect((0, 0), (20, 20)))
+    pattern5.add(dwg.line((0, 20), (20, 20)))
 
-        if hours:               hours = float(hours)
-        if weekday_start_hour:  weekday_start_hour = float(weekday_start_hour)
-        if weekday_end_hour:    weekday_end_hour = float(weekday_end_hour)
+    return [pattern1, pattern2, pattern3, pattern4, pattern5]
+
+@functools.lru_cache(maxsize=1)
+def pattern_defs():
+    'Returns the pattern defs as SvgElements, drawn once and shared by every SvgStream drawing.'
+
+    return tuple(draw_patterns(SvgStream(None)))
+
+def element_extent(element, vert=False):
+    '''Returns the (x1, y1, x2, y2) bounding box of an SvgElement and its subelements, or None if it has no coordinates.
+    Text gets a rough box from its length, as it would be laid out; vert text runs down from its anchor.'''
+
+    a = element.attribs
+    vert = vert or 'vert' in str(a.get('class', '')).split()
+    if element.name == 'text':
+        x, y, n = float(a['x']), float(a['y']), len(element.text)
+        extent = (x - 4, y - n*5, x + 12, y + n*5) if vert else (x - n*4, y - 16, x + n*8, y + 4)
+    elif element.name == 'line':
+        x1, y1, x2, y2 = float(a['x1']), float(a['y1']), float(a['x2']), float(a['y2'])
+        extent = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+    elif element.name == 'polygon':
+        points = [tuple(map(float, p.split(','))) for p in a['points'].split()]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        extent = (min(xs), min(ys), max(xs), max(ys))
+    elif element.name == 'circle':
+        x, y, r = float(a['cx']), float(a['cy']), float(a['r'])
+        extent = (x - r, y - r, x + r, y + r)
+    else:
+        extent = None
+
+    for e in element.elements:
+        sub = element_extent(e, vert)
+        if sub is not None:
+            extent = sub if extent is None else (min(extent[0], sub[0]), min(extent[1], sub[1]), max(extent[2], sub[2]), max(extent[3], sub[3]))
+    return extent
+
+class SvgTiles(SvgStream):
+    '''Stands in for svgwrite.Drawing, but keeps the drawing as bare elements with their bounding boxes,
+    so that save_tiles() can cut it up into horizontal bands, each a complete svg of its own in directory outdir.'''
+
+    def __init__(self, outdir, **attribs):
+        super().__init__(None, **attribs)
+        self.outdir = outdir
+        self.elements = []
+        self.box = (0, 0, 0, 0)
+        self.only_scale = None      # If set, elements added are only drawn into the tiles of the level of that scale
+
+    def viewbox(self, minx=0, miny=0, width=0, height=0):
+        self.box = (minx, miny, width, height)
+
+    def add(self, element):
+        self.elements.append((element_extent(element), element, self.only_scale))
+        return element
+
+    def save_tiles(self, levels, min_px=4):
+        '''Writes a tile for every (name, y1, y2) band of every (scale, bands) level into outdir.
+        A tile holds the elements that intersect its band. Levels zoomed out by scale leave out text,
+        and any element smaller than min_px*scale, as it would not be seen anyway.
+        Elements added for a single scale (see only_scale) are only drawn, as they are, into that level.
+        Returns the manifest of the tiles, to be read by tiles.html.'''
+
+        os.makedirs(self.outdir, exist_ok=True)
+        minx, miny, width, height = self.box
+        manifest = dict(width=width, height=height, stylesheets=[s[0] for s in self._stylesheets], levels=[])
+
+        for level, (scale, bands) in enumerate(levels):
+            tiles = []
+            for name, y1, y2 in bands:
+                fn = 'tile-%d-%s.svg' % (level, name)
+                tile = SvgStream(os.path.join(self.outdir, fn), preserveAspectRatio='xMidYMid meet')
+                tile._stylesheets = self._stylesheets
+                tile.defs = self.defs
+                tile.viewbox(minx, y1, width, y2 - y1)
+
+                num_elements = 0
+                for extent, element, only_scale in self.elements:
+                    if extent is not None and (extent[3] < y1 or extent[1] > y2):
+                        continue
+                    if only_scale is not None:
+                        if only_scale != scale:
+                            continue
+                    elif scale > 1:
+                        element = without_text(element)
+                        extent = element and element_extent(element)
+                        if element is None or (extent is not None and max(extent[2] - extent[0], extent[3] - extent[1]) < min_px*scale):
+                            continue
+                    tile.add(element)
+                    num_elements += 1
+                tile.save()
+
+                tiles.append(dict(file=fn, name=name, y=y1, height=y2 - y1, elements=num_elements))
+            manifest['levels'].append(dict(scale=scale, tiles=tiles))
+
+        import json
+        with open(os.path.join(self.outdir, 'manifest.json'), 'w') as fp:
+            json.dump(manifest, fp, indent=1)
+        return manifest
+
+def without_text(element):
+    '''Returns element without any of its text: itself if it holds none, a pruned copy if it does,
+    or None if nothing but text is left.'''
+
+    if element.name == 'text':
+        return None
+    if not element.elements:
+        return element
+
+    elements = [e for e in map(without_text, element.elements) if e is not None]
+    if not elements:
+        return None
+    if len(elements) == len(element.elements) and all(a is b for a, b in zip(elements, element.elements)):
+        return element
+
+    pruned = SvgElement(element.name)
+    pruned.attribs = element.attribs
+    pruned.elements = elements
+    return pruned
+
+
+def number(v, precision=1):
+    'Returns v rounded to precision decimals, as an int if it is whole.'
+
+    v = round(float(v), precision)
+    return int(v) if v == int(v) else v
+
+def compact_element(element, precision=1):
+    '''Returns a smaller SvgElement that draws the same as element: axis-aligned polygons become rects,
+    coordinates are rounded to precision decimals, and groups that add nothing are dropped:
+    bare ones around a single element, and ones around a single link, which takes over their attributes.
+    Groups around labels stay, as biograph.css styles labels through them.'''
+
+    a = element.attribs
+    if element.name == 'polygon':
+        points = [tuple(number(c, precision) for c in p.split(',')) for p in a['points'].split()]
+        xs, ys = sorted(set(p[0] for p in points)), sorted(set(p[1] for p in points))
+        if len(points) == 4 and len(xs) == 2 and len(ys) == 2 and set(points) == set((x, y) for x in xs for y in ys):
+            rect = SvgElement('rect')
+            rect.attribs = dict((k, v) for k, v in a.items() if k != 'points')
+            rect.attribs.update(x=xs[0], y=ys[0], width=number(xs[1] - xs[0], precision), height=number(ys[1] - ys[0], precision))
+            return rect
+        compact = SvgElement('polygon', element.text)
+        compact.attribs = dict(a, points=' '.join('%s,%s' % p for p in points))
+        return compact
+
+    elements = [compact_element(e, precision) for e in element.elements]
+    if element.name == 'g' and len(elements) == 1 and not element.text:
+        inner = elements[0]
+        if not a:
+            return inner
+        if inner.name == 'a' and not set(a) & set(inner.attribs):
+            link = SvgElement('a', inner.text)
+            link.attribs = dict(a, **inner.attribs)
+            link.elements = inner.elements
+            return link
+
+    compact = SvgElement(element.name, element.text)
+    compact.attribs = dict((k, number(v, precision) if isinstance(v, (int, float)) else v) for k, v in a.items())
+    compact.elements = elements
+    return compact
+
+class SvgCompact(SvgStream):
+    '''Stands in for svgwrite.Drawing, but writes a smaller svg on save(): elements are compacted by compact_element(),
+    and bare shapes repeated at different heights, like year ticks, are drawn once as a <symbol> and placed with <use>.
+    A filename ending in .svgz is gzip compressed.'''
+
+    symbol_ys = dict(line=['y1', 'y2'], rect=['y'], circle=['cy'])     # Coordinates a <use> can move
+
+    def __init__(self, filename, precision=1, min_uses=3, **attribs):
+        super().__init__(filename, **attribs)
+        self.precision = precision
+        self.min_uses = min_uses
+        self.elements = []
+
+    def viewbox(self, minx=0, miny=0, width=0, height=0):
+        super().viewbox(*(number(v, self.precision) for v in (minx, miny, width, height)))
+
+    def add(self, element):
+        element = compact_element(element, self.precision)
+        ys = self.symbol_ys.get(element.name)
+        if ys and not element.elements and not element.text:
+            y = min(element.attribs[k] for k in ys)
+            key = (element.name, tuple(sorted((k, number(v - y, self.precision) if k in ys else v) for k, v in element.attribs.items())))
+            self.elements.append((key, y, element))
+        else:
+            self.elements.append((None, 0, element))
+        return element
+
+    def start(self):
+        if isinstance(self.filename, str) and self.filename.endswith('.svgz'):
+            import gzip
+            self.filename = io.TextIOWrapper(gzip.GzipFile(self.filename, 'wb', mtime=0), encoding='utf-8')
+            self.gzipped = True
+        super().start()
+
+    def save(self):
+        uses = collections.Counter(key for key, y, element in self.elements if key)
+        symbols = {}
+        for key, n in uses.items():
+            if n >= self.min_uses:
+                symbols[key] = 's%d' % len(symbols)
+                symbol = self.defs.add(SvgElement('symbol', id=symbols[key], overflow='visible'))
+                symbol.add(SvgElement(key[0])).attribs = dict(key[1])
+
+        for key, y, element in self.elements:
+            if key in symbols:
+                element = SvgElement('use', y=y or None)
+                element['xlink:href'] = '#' + symbols[key]
+            SvgStream.add(self, element)
+        SvgStream.save(self)
+        if getattr(self, 'gzipped', False):
+            self.filename.close()
+
+## Thumbnails
+css_colors = {              # Named css colours understood by the thumbnails
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'red': (255, 0, 0),
+    'grey': (128, 128, 128),
+    'gray': (128, 128, 128),
+    'lavender': (230, 230, 250),
+    'mintcream': (245, 255, 250),
+    'floralwhite': (255, 250, 240)
+}
 
-        # First handle the special cases ...
-        if type == 'option':
-            assert label in timeline_options, label
-            timeline_options[label] = int(start_isodate or '0') # current container for the option value
+def css_color(value):
+    'Returns the (r, g, b) of a css colour value, or None if it is not a plain colour.'
+
+    import re
+    value = value.strip().lower()
+    if value in css_colors:
+        return css_colors[value]
+    if re.fullmatch(r'#[0-9a-f]{3}', value):
+        return tuple(int(c*2, 16) for c in value[1:])
+    if re.fullmatch(r'#[0-9a-f]{6}', value):
+        return tuple(int(value[i:i+2], 16) for i in (1, 3, 5))
+    return None
+
+def read_css_fills(fn_css):
+    '''Returns the fill rules of a stylesheet as a list of (tag, class, descendant tag, (r, g, b), opacity), in order.
+    Only the selectors biograph.css is made of are understood: tag.class, .class and .class tag (pseudo-classes are ignored).'''
+
+    import re
+    with open(fn_css, encoding='utf-8') as fp:
+        css = re.sub(r'/\*.*?\*/', '', fp.read(), flags=re.S)
+
+    rules = []
+    for selectors, declarations in re.findall(r'([^{}]+)\{([^{}]*)\}', css):
+        decls = dict((k.strip(), v.strip()) for k, _, v in (d.partition(':') for d in declarations.split(';')) if v.strip())
+        color = css_color(decls.get('fill', ''))
+        if color is None:
+            continue
+        opacity = float(decls.get('fill-opacity', 1))
+        for selector in selectors.split(','):
+            m = re.fullmatch(r'(\w*)\.([\w-]+)(?::[\w-]+(?:\([^)]*\))?)*(?:\s+(\w+))?', selector.strip())
+            if m:
+                rules.append((m.group(1) or None, m.group(2), m.group(3), color, opacity))
+    return rules
+
+def write_png(fn, rgb):
+    'Writes an (height, width, 3) uint8 array as an 8-bit rgb png.'
+
+    import zlib
+
+    height, width, _ = rgb.shape
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    # Every scanline starts with filter type 0 (none)
+    raw = b''.join(b'\0' + row.tobytes() for row in rgb)
+    with open(fn, 'wb') as fp:
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        fp.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        fp.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        fp.write(chunk(b'IEND', b''))
+
+class SvgRaster(SvgStream):
+    '''Stands in for svgwrite.Drawing, but paints the drawing into a width x height png thumbnail on save(), without a browser.
+    Rectangles, circles and lines are painted with the fills of the drawing's stylesheets, as found next to filename
+    or else next to biograph.py; text is left out. The drawing is scaled to fit, keeping its aspect ratio.
+    Requires numpy.'''
+
+    def __init__(self, filename, width=300, height=None, **attribs):
+        super().__init__(filename, **attribs)
+        self.width = width
+        self.height = height
+        self.elements = []
+        self.box = (0, 0, 0, 0)
+
+    def viewbox(self, minx=0, miny=0, width=0, height=0):
+        self.box = (minx, miny, width, height)
+
+    def add(self, element):
+        self.elements.append(element)
+        return element
+
+    def fills(self):
+        'Returns the fill rules of the stylesheets, in order.'
+
+        rules = []
+        for href, *_ in self._stylesheets:
+            for folder in [os.path.dirname(os.path.abspath(self.filename)), os.path.dirname(os.path.abspath(__file__))]:
+                if os.path.isfile(os.path.join(folder, href)):
+                    rules += read_css_fills(os.path.join(folder, href))
+                    break
+        return rules
+
+    def save(self):
+        import numpy as np
+
+        minx, miny, box_width, box_height = self.box
+        width = self.width
+        height = self.height or max(1, round(width * box_height / box_width))
+        scale = min(width / box_width, height / box_height)
+        dx = (width - box_width*scale) / 2 - minx*scale
+        dy = (height - box_height*scale) / 2 - miny*scale
+        img = np.full((height, width, 3), 255, dtype=np.uint8)
+
+        rules = self.fills()
+        fill_cache = {}
+        def fill(element, classes, outer):
+            'Returns the (r, g, b), opacity of element: black unless the last matching rule says otherwise, as in svg.'
+
+            key = (element.name, classes, outer)
+            if key not in fill_cache:
+                color = ((0, 0, 0), 1.0)
+                for tag, cls, inner, rgb, opacity in rules:
+                    if (inner is None and tag in (None, element.name) and cls in classes) or (inner == element.name and cls in outer):
+                        color = (rgb, opacity)
+                fill_cache[key] = color
+            return fill_cache[key]
+
+        def paint(x1, y1, x2, y2, rgb, opacity):
+            # Anything drawn covers at least a pixel
+            x1, y1 = max(0, int(x1*scale + dx)), max(0, int(y1*scale + dy))
+            x2, y2 = max(x1 + 1, int(x2*scale + dx + 0.5)), max(y1 + 1, int(y2*scale + dy + 0.5))
+            if opacity >= 1:
+                img[y1:y2, x1:x2] = rgb
+            else:
+                img[y1:y2, x1:x2] = img[y1:y2, x1:x2] * (1 - opacity) + np.array(rgb) * opacity
+
+        def walk(element, outer, opacity):
+            a = element.attribs
+            classes = frozenset(str(a.get('class', '')).split())
+            # Opacity attributes multiply, down from the groups an element is in, with that of its fill
+            opacity *= float(a.get('opacity', 1))
+            if element.name in ['polygon', 'circle']:
+                rgb, fill_opacity = fill(element, classes, outer)
+                fill_opacity *= opacity * float(a.get('fill-opacity', 1))
+            if element.name == 'polygon':
+                points = [tuple(map(float, p.split(','))) for p in a['points'].split()]
+                xs, ys = [p[0] for p in points], [p[1] for p in points]
+                paint(min(xs), min(ys), max(xs), max(ys), rgb, fill_opacity)
+            elif element.name == 'circle':
+                x, y, r = float(a['cx']), float(a['cy']), max(float(a['r']), 0.5 / scale)
+                paint(x - r, y - r, x + r, y + r, rgb, fill_opacity)
+            elif element.name == 'line':
+                x1, y1, x2, y2 = (float(a[k])*scale + d for k, d in [('x1', dx), ('y1', dy), ('x2', dx), ('y2', dy)])
+                n = int(max(abs(x2 - x1), abs(y2 - y1))) + 1
+                xs = np.clip(np.linspace(x1, x2, n).astype(int), 0, width - 1)
+                ys = np.clip(np.linspace(y1, y2, n).astype(int), 0, height - 1)
+                rgb = np.array(css_color(str(a.get('stroke', 'black'))) or (0, 0, 0))
+                stroke_opacity = opacity * float(a.get('stroke-opacity', 1))
+                img[ys, xs] = rgb if stroke_opacity >= 1 else img[ys, xs] * (1 - stroke_opacity) + rgb * stroke_opacity
+            for e in element.elements:
+                walk(e, outer | classes, opacity)
+
+        for element in self.elements:
+            walk(element, frozenset(), 1.0)
+
+        write_png(self.filename, img)
+
+
+## Bundles
+def prune_css(css, tags, classes, ids):
+    '''Returns css minified, with only the selectors whose tags, classes and ids are all in the given sets.
+    Pseudo-classes are kept without being checked; rules left without selectors are dropped.'''
+
+    import re
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+
+    pruned = []
+    for selectors, declarations in re.findall(r'([^{}]+)\{([^{}]*)\}', css):
+        kept = []
+        for selector in selectors.split(','):
+            selector = ' '.join(selector.split())
+            bare = re.sub(r':[\w-]+(?:\([^)]*\))?', '', selector)
+            if (set(re.findall(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)', bare)) <= tags and
+                    set(re.findall(r'\.([\w-]+)', bare)) <= classes and set(re.findall(r'#([\w-]+)', bare)) <= ids):
+                kept.append(selector)
+        decls = ';'.join('%s:%s' % (k.strip(), ' '.join(v.split())) for k, _, v in (d.partition(':') for d in declarations.split(';')) if v.strip())
+        if kept and decls:
+            pruned.append('%s{%s}' % (','.join(kept), decls))
+    return ''.join(pruned)
+
+def bundle_svg(svg, css):
+    '''Returns a drawn svg (text) that needs no other file: its stylesheet links are replaced by css,
+    pruned to the tags and classes the svg uses, and the patterns that nothing fills with are left out.'''
+
+    import re
+    head = svg[:svg.index('\n') + 1] if svg.startswith('<?xml version') else ''
+    body = svg[svg.index('<svg'):]
+
+    def uses(body):
+        tags = set(re.findall(r'<(\w+)', body))
+        classes = set(c for attrib in re.findall(r' class="([^"]*)"', body) for c in attrib.split())
+        return tags, classes
+
+    # Patterns are used through the classes that fill with them
+    patterns = re.compile(r'<pattern\b[^>]*\bid="([\w-]+)"[^>]*>.*?</pattern>', re.S)
+    drawn = patterns.sub('', body)
+    tags, classes = uses(drawn)
+    ids = set(re.findall(r'url\(#([\w-]+)\)', prune_css(css, tags, classes, set()) + drawn))
+    body = patterns.sub(lambda m: m.group(0) if m.group(1) in ids else '', body)
+
+    tags, classes = uses(body)
+    css = prune_css(css, tags, classes, ids)
+    assert '<' not in css, 'stylesheets cannot hold markup'
+    style = '<style>' + css + '</style>'
+
+    # Inside the defs, which may be empty as <defs/>, or missing
+    defs = re.search(r'<defs\b([^>]*?)\s*(/?)>', body)
+    if defs is None:
+        start = body.index('>') + 1
+        return head + body[:start] + '<defs>' + style + '</defs>' + body[start:]
+    if defs.group(2):
+        return head + body[:defs.start()] + '<defs%s>%s</defs>' % (defs.group(1), style) + body[defs.end():]
+    return head + body[:defs.end()] + style + body[defs.end():]
+
+def bundle_html(svg, title='Biograph'):
+    'Returns a bundled svg (see bundle_svg()) inline in a web page laid out like index.html.'
+
+    return ('<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"/><title>%s</title>'
+            '<style>div.mainwrap{width:1100px;border:2px solid gray}</style></head>'
+            '<body><div class="mainwrap">%s</div></body></html>') % (escape_text(title), svg[svg.index('<svg'):])
+
+
+## The biograph
+RESIDENCE, OCCURRENCE, SLEEPMATE, WEEKDAY, WEEKEND = range(5)
+
+def read_tsv(fn_tsv):
+    '''Streams the rows of a blueprint.tsv, given as a filename or an open file, as lists of fields.
+    Checks the headers first and skips blank lines; the file is only read as far as the rows are consumed.'''
+
+    import csv
+    fp = open(fn_tsv, encoding='utf-8', newline='') if isinstance(fn_tsv, str) else fn_tsv
+    try:
+        reader = csv.reader(fp, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+        # Inspects that the blueprint has the correct structure
+        saved_headers = next(reader, [])
+        assert saved_headers == headers, saved_headers
+
+        for fields in reader:
+            if fields:
+                yield fields
+    finally:
+        if fp is not fn_tsv:
+            fp.close()
+
+def parse_memory(fields):
+    '''Turns the fields of a blueprint.tsv row into the arguments of generic(), followed by its kwargs:
+    (type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs).'''
+
+    import json
+    type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, href, title, slot, rest = fields
+    kwargs = {}
+
+    if href:  kwargs['href'] = href
+    if title: kwargs['title'] = title
+    if slot:  kwargs['slot'] = float(slot)
+    if rest:  kwargs.update(json.loads(rest))
+
+    if hours:               hours = float(hours)
+    if weekday_start_hour:  weekday_start_hour = float(weekday_start_hour)
+    if weekday_end_hour:    weekday_end_hour = float(weekday_end_hour)
+
+    if type in ['home', 'event']:
+        intensity = 0
+    elif type not in ['option', 'timespan']:
+        intensity = int(intensity)
+
+    return type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs
+
+def option_value(label, field):
+    '''Returns the value of the option label in the field of a blueprint.tsv row: a number, 0 if empty,
+    of the type of the option's default where that keeps its value (so 1.5 stays 1.5 where 52 would do).'''
+
+    value = float(field or '0')
+    cast = type(default_timeline_options[label])
+    return cast(value) if cast(value) == value else value
+
+class Memory:
+    '''A remembered memory, as given to generic(): its type and label are interned, and it is only serialized
+    into the fields of a blueprint.tsv row, with its kwargs as json, when fields() is called.
+    Iterating over or indexing a memory goes through those fields, as when memories were kept as rows.'''
+
+    __slots__ = ('type', 'intensity', 'label', 'start_isodate', 'end_isodate', 'weekday_start_hour', 'weekday_end_hour', 'hours', 'kwargs')
+
+    def __init__(self, type, intensity, label, start_isodate, end_isodate=None, weekday_start_hour=None, weekday_end_hour=None, hours=None, kwargs=None):
+        self.type = sys.intern(type)
+        self.intensity = intensity
+        self.label = sys.intern(label) if isinstance(label, str) else label
+        self.start_isodate = start_isodate
+        self.end_isodate = end_isodate
+        self.weekday_start_hour = weekday_start_hour
+        self.weekday_end_hour = weekday_end_hour
+        self.hours = hours
+        self.kwargs = kwargs
+
+    def fields(self):
+        'Returns the memory as the list of blueprint.tsv fields.'
+
+        import json
+        kwargs = self.kwargs or {}
+        href  = kwargs['href'] if 'href' in kwargs else ''
+        title = kwargs['title'] if 'title' in kwargs else  ''
+        slot  = kwargs['slot'] if 'slot' in kwargs else ''
+        rest  = json.dumps(kwargs) if kwargs else ''
+
+        # Boolean options are written as 1 and '' so that draw_row() reads them back with option_value()
+        return list(str(int(x) if x is True else x or '') for x in [self.type, self.intensity, self.label, self.start_isodate, self.end_isodate,
+                                           self.weekday_start_hour, self.weekday_end_hour, self.hours, href, title, slot, rest])
+
+    def __iter__(self):
+        return iter(self.fields())
+
+    def __getitem__(self, i):
+        return self.fields()[i]
+
+    def __len__(self):
+        return len(headers)
+
+class Biograph:
+    '''Everything that goes into drawing one biograph: its options, memories, colours, grid and svg drawing.
+    Biographs do not share any state, so several of them can be drawn at the same time in different threads.'''
+
+    def __init__(self, timeline_options=None):
+        self.timeline_options = dict(default_timeline_options) if timeline_options is None else timeline_options
+        self.residence_colors = {}
+        self.saved_memories = []
+        self.event_colors = {}
+        self.dwg = None
+        self.label_index = None
+        self.events = []
+
+        # Allow convenient access of dictionary values (dict.key)
+        self.options = TypedAttrDict(self.timeline_options)
+
+    def reset(self):
+        'Forgets the previous biograph, so that the next one starts from the default options and colours.'
+
+        self.timeline_options.clear()
+        self.timeline_options.update(default_timeline_options)
+        self.residence_colors.clear()
+        self.event_colors.clear()
+        self.saved_memories.clear()
+        self.label_index = None
+        self.events = []
+
+        # Allow convenient access of dictionary values (dict.key)
+        self.options = TypedAttrDict(self.timeline_options)
+
+    ## Helpers
+    def private(self, s, censored=''):
+        return s if self.options.private else censored
+
+    def wrap_link(self, svg_obj, href):
+        'Makes an svg_obj clickable with a link to href.'
+
+        if href:
+            outer = self.dwg.a(href, target='_blank')
+            outer.add(svg_obj)
+            svg_obj = outer
+
+        return svg_obj
+
+    def add_obj(self, parent, svg_obj):
+        'Add svg_obj as a subelement to parent'
+
+        if not parent:
+            parent = self.dwg
+        parent.add(svg_obj)
+
+    def parse_date(self, isodate):
+        'Returns the y-axis coordinate for an isodate (YYYY-MM-DD).'
+
+        return self.date_axis.y(isodate)
+
+    def width_from_hours(self, num_days, num_hours):
+        'Given total num_hours spent over num_days, returns the width in pixels'
+
+        # Input Quality
+        assert num_hours <= (num_days*16)
+
+        self.options.weekday_hour_width = self.weekday_hour(10) - self.weekday_hour(9)
+        return  (num_hours/260) * self.options.weekday_hour_width / (num_days/365)
+
+    def weekday_hour(self, hr):
+        'Returns the x-axis coordinate for a weekday time.'
+
+        x_scale = (self.weekday_right_grid-self.weekday_left_grid) / (self.options.weekday_end_hour-self.options.weekday_start_hour)
+        return self.weekday_left_grid + (hr-self.options.weekday_start_hour) * x_scale
+
+
+    ## Pencil strokes
+    def text(self, x, y, label, align=None, parent=None, href=None, **kwargs):
+        '''Draws label at (x,y).
+        font_size is in ems.
+        Optionally, label can link to href.'''
+
+        # Coordinates
+        x,y = int(x),int(y)
+        if self.label_index is not None and str(label):
+            placed = self.place_label(x, y, str(label), align, kwargs)
+            if placed is None:
+                return
+            x, y, kwargs = placed
+
+        # Drawing
+        if align is not None:
+            add_class(kwargs, align)
+        p = self.dwg.g(**kwargs)
+        t = self.dwg.text(str(label), x = [x+3], y = [y])
+        p.add(self.wrap_link(t, href))
+        self.add_obj(parent, p)
+
+    def place_label(self, x, y, label, align, kwargs):
+        '''Finds a spot near (x, y) for a label that does not overlap any label placed before it (see LabelIndex).
+        The label is nudged across its direction by up to two lines, then turned the other way and nudged again.
+        Returns the (x, y, kwargs) to draw it with, or None if it has to be left out.'''
+
+        classes = kwargs.get('class_', '').split()
+        vert = 'vert' in classes
+        size = max([label_ems.get(c, 0.7) for c in classes] + [0.7]) * 16   # pixels per em
+        length = len(label) * size * 0.55
+        centered = align == 'middle'
+
+        for turned in [vert, not vert]:
+            for nudge in [0, -1, 1, -2, 2]:
+                dx, dy = (int(nudge*size), 0) if turned else (0, int(nudge*size))
+                lx, ly = x + 3 + dx, y + dy
+                if turned:
+                    top = ly - length/2 if centered else ly
+                    box = (lx - size/2, top, lx + size/2, top + length)
+                else:
+                    left = lx - length/2 if centered else lx
+                    box = (left, ly - size, left + length, ly + size/4)
+
+                if not self.label_index.overlaps(box):
+                    self.label_index.add(box)
+                    if turned != vert:
+                        kwargs = dict(kwargs, class_=' '.join(classes + ['vert'] if turned else [c for c in classes if c != 'vert']))
+                    return x + dx, y + dy, kwargs
+
+        return None
+
+    def text_left(self, x1, y1, x2, y2, label, font_size=0.7, align='middle', parent=None, href=None, **kwargs):
+        '''Draws label at coordinate x1, in between coordinates y1 to y2.
+        font_size is in ems.
+        Optionally, label can link to href.'''
+
+        x = x1
+        y = mid(y1, y2) + 10
+        self.text(x, y, label, None, parent, href, **kwargs)
+
+    def text_center(self, x1, y1, x2, y2, label, align='middle', parent=None, href=None, **kwargs):
+        '''Draws label in the center of coordinates (x1, y1) to (x2, y2).
+        font_size is in ems.
+        Optionally, label can link to href.'''
+
+        x, y, vert = self.label_anchor(x1, y1, x2, y2, label)
+        if vert:
+            add_class(kwargs, 'vert')
+        self.text(x, y, label, align, parent, href, **kwargs)
+
+    def label_anchor(self, x1, y1, x2, y2, label):
+        '''Returns the (x, y) at which label is centered between coordinates (x1, y1) to (x2, y2),
+        and whether it has to be drawn vertically to fit.'''
+
+        x = mid(x1, x2-self.underhang_offset)
+        y = mid(y1, y2)+self.underhang_offset
+        return x, y, abs(y2-y1) > abs(x2-x1) and len(label)*10 > abs(x2-x1)
+
+    def line(self, x1, y1, x2, y2, color='grey'):
+        'Draws a colored line from (x1, y1) to (x2, y2).'
+
+        # Coordinates
+        x1,y1,x2,y2 = int(x1),int(y1),int(x2),int(y2)
+
+        # Drawing
+        self.dwg.add(self.dwg.line((x1, y1), (x2, y2), stroke=color))
+
+    def rectangle(self, x1, y1, x2, y2, href=None, title=None, parent=None, color='rectangle', **kwargs):
+        '''Draws a rectangle from coordinates (x1, y1) to (x2, y2).
+        **kwargs: css styling.'''
+
+        # Coordinates
+        x1,y1,x2,y2 = int(x1),int(y1),int(x2),int(y2)
+        points = [(x1,y1), (x2,y1), (x2,y2), (x1,y2)]
+
+        # Drawing
+        add_class(kwargs, color)
+        p = self.dwg.polygon(points, **kwargs)
+        self.add_obj(parent, self.wrap_link(p, href))
+        return p
+
+    def box(self, x1, y1, x2, y2, label, label_x, label_y, vert, **kwargs):
+        '''Draws a rectangle from coordinates (x1, y1) to (x2, y2) with its label at (label_x, label_y).
+        **kwargs: css styling.'''
+
+        self.rectangle(x1, y1, x2, y2, **kwargs)
+        if vert:
+            add_class(kwargs, 'vert')
+        self.text(label_x, label_y, label, 'middle', **kwargs)
+
+    def dot(self, x, y, label, radius=3, parent=None, href=None, **kwargs):
+        '''Draws a circle of radius centered at (x, y) with its label to the right.
+        **kwargs: css styling.'''
+
+        p = self.dwg.circle((x, y), (radius), **kwargs)
+        self.add_obj(parent, self.wrap_link(p, href))
+        self.text(x + radius, y+5, label, class_='event', href=href)
+
+
+    ## Where the magic happens
+    def occurrence(self, css_color, label, start_isodate, end_isodate, parent=None, href=None, **kwargs):
+        '''Draws a circle representing short duration events on the event line.
+        Event is centered between start_isodate (YYYY-MM-DD) and end_isodate (YYYY-MM-DD). Size of the circle is proportional to the event duration.'''
+
+        # Input Quality
+        assert start_isodate <= end_isodate, (start_isodate, end_isodate)
+
+        # Coordinates
+        start_date = self.parse_date(start_isodate)
+        end_date = self.parse_date(end_isodate)
+        event_midpoint = mid(start_date, end_date)
+
+        # Drawing
+        add_class(kwargs, css_color)
+        if self.options.cluster_events and parent is None:
+            return self.hold_event(self.event_line_x, event_midpoint, label, href=href, **kwargs)
+        self.dot(self.event_line_x, event_midpoint, label, parent=parent, href=href, **kwargs)
+
+    def hold_event(self, x, y, label, href=None, **kwargs):
+        'Holds back the dot of an event at (x, y) until draw_events() clusters it with its neighbours.'
+
+        self.events.append((x, y, label, href, kwargs))
+
+    def draw_events(self, scale=1, max_titles=20):
+        '''Draws the events held back by the cluster_events option, in one pass down the event line:
+        events less than cluster_events*scale pixels apart are drawn as one larger dot, labelled with their count
+        and with their labels (up to max_titles) as its tooltip; lone events are drawn as usual.
+        Above a scale of 1, as for overview tiles, dots are scale times larger and left unlabelled.'''
+
+        events = sorted(self.events, key=lambda event: event[1])
+        if isinstance(self.dwg, SvgTiles):
+            self.dwg.only_scale = scale
+
+        for first, last in cluster_runs([event[1] for event in events], self.options.cluster_events * scale):
+            x, y, label, href, kwargs = events[first]
+            if last - first == 1:
+                if scale == 1:
+                    self.dot(x, y, label, href=href, **kwargs)
+                else:
+                    self.add_obj(None, self.wrap_link(self.dwg.circle((x, y), 3*scale, **kwargs), href))
+                continue
+
+            # Coordinates
+            y = mid(y, events[last-1][1])
+            labels = [event[2] for event in events[first:last] if event[2]]
+            if len(labels) > max_titles:
+                labels = labels[:max_titles] + ['and %d more' % (len(labels) - max_titles)]
+
+            # Drawing
+            kwargs = dict(kwargs)
+            add_class(kwargs, 'cluster')
+            p = self.dwg.circle((x, y), 5*scale, **kwargs)
+            p.set_desc(title='\n'.join(labels))
+            self.add_obj(None, p)
+            if scale == 1:
+                self.text(x + 5, y+5, '%d events' % (last - first), class_='event')
+
+        if isinstance(self.dwg, SvgTiles):
+            self.dwg.only_scale = None
+
+    def flush_events(self):
+        'Draws the events held back so far (see draw_events()), and lets go of them so that they are drawn once.'
+
+        if self.events:
+            self.draw_events()
+            self.events = []
+
+    def weekday(self, css_color, label, start_isodate, end_isodate, start_hour, end_hour, **kwargs):
+        '''Draws a weekday event from (start_hour, start_isodate (YYYY-MM-DD)) to (end_hour, end_isodate (YYYY-MM-DD)).
+        **kwargs: optional css styling.'''
+
+        end_isodate = end_isodate or self.top_isodate
+
+        # Input Quality
+        assert start_isodate < end_isodate, (start_isodate, end_isodate)
+
+        # Coordinates
+        y1 = self.parse_date(start_isodate)
+        y2 = self.parse_date(end_isodate)
+        x1 = self.weekday_hour(start_hour)
+        x2 = self.weekday_hour(end_hour)
+
+        # Drawing
+        add_class(kwargs, css_color)
+        self.box(x1, y1, x2, y2, label, *self.label_anchor(x1, y1, x2, y2, label), **kwargs)
+
+    def sleepmate(self, css_color, label, start_isodate, end_isodate, slot=0, **kwargs):
+        '''Draws pillow cuddle-friends you had from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).
+        There are four available slots for 4 home-mates. You can indicate which one you want occupied by setting slot to 0-3.
+        **kwargs: optional css styling.'''
+
+        end_isodate = end_isodate or self.top_isodate
+
+        # Input Quality
+        assert start_isodate < end_isodate
+        roommate_width = self.width_from_hours(7, 2)
+        # Coordinates
+        y1 = self.parse_date(start_isodate)
+        y2 = self.parse_date(end_isodate)
+        x1 = self.weekday_left_grid - (roommate_width*(slot)+15)
+        x2 = x1 + roommate_width
+
+        # Drawing
+        add_class(kwargs, css_color)
+        self.box(x1, y1, x2, y2, label, *self.label_anchor(x1, y1, x2, y2, label), **kwargs)
+
+    def weekend(self, css_color, label, start_isodate, end_isodate, hours_per_week, slot=0, **kwargs):
+        '''Draws a weekend event from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).
+        Width of the drawing is proportional to the hours_per_week invested.
+        **kwargs: optional css styling.'''
+
+        end_isodate = end_isodate or self.top_isodate
+        # Input Quality
+        assert start_isodate < end_isodate
+
+        if slot < 0:
+            slot = 0
+        elif slot > 4:
+            slot = 4
+
+        # Coordinates
+        num_days = self.date_axis.ordinal(end_isodate) - self.date_axis.ordinal(start_isodate)
+        num_hours = hours_per_week * num_days / 7
+
+        y1 = self.parse_date(start_isodate)
+        y2 = self.parse_date(end_isodate)
+        x1 = self.weekday_right_grid + 1 + self.width_from_hours(2, slot*2)
+        x2 = x1 + self.width_from_hours(num_days, num_hours)
+
+        # Drawing
+        add_class(kwargs, css_color)
+        self.box(x1, y1, x2, y2, label, *self.label_anchor(x1, y1, x2, y2, label), **kwargs)
+
+
+    def residence(self, css_color, label, start_isodate, end_isodate, **kwargs):
+        '''Draws a box of y-axis length = duration of stay at a residence.
+        **kwargs: optional css styling.'''
+
+        end_isodate = end_isodate or self.top_isodate
+
+        # Input Quality
+        assert start_isodate < end_isodate, (start_isodate, end_isodate)
+
+        # Coordinates
+        start_date = self.parse_date(start_isodate)
+        end_date = self.parse_date(end_isodate)
+        x1 = self.options.left_grid
+        y1 = start_date
+        x2 = self.weekend_right_grid
+        y2 = end_date
+
+        # Drawing
+        add_class(kwargs, css_color)
+        add_class(kwargs, 'residence')
+        self.rectangle(x1, y1, x2, y2, **kwargs)
+        if label:
+            self.text_left(self.options.left_grid, y1-8, self.weekday_left_grid, y1-15, label,  align='middle')
+
+
+    ## Canvas
+    def timespan(self, start_isodate, end_isodate, **kwargs):
+        'Draws the histomap grid from start_isodate (YYYY-MM-DD) to end_isodate (YYYY-MM-DD).'
+
+        # Set options
+        self.timeline_options.update(**kwargs)
+        for k, v in kwargs.items():
+            self.generic('option', 0, k, v)
+
+        self.generic('timespan', 0, '', start_isodate, end_isodate)
+
+        # Set dates
+        assert start_isodate < end_isodate
+        self.top_isodate = end_isodate
+        self.top_date    = parse_datetime(end_isodate)     # Final recorded day
+        self.bottom_date = parse_datetime(start_isodate)   # First recorded day
+
+        # If year_height is set, it takes priority over bottom_grid
+        if self.options.year_height is not None:
+            days_alive = (self.top_date - self.bottom_date).days
+            num_years = days_alive/365
+            self.options.bottom_grid = num_years * self.options.year_height
+
+        # Set the bounds of the viewport such that the entire map can be viewed.
+        self.dwg.viewbox(width=self.options.right_grid+150, height=self.options.bottom_grid+50)
+
+        # Set grid variables
+
+        self.underhang_offset = 5               # ensures text does sit below drawn lines
+        self.top_grid = self.options.top_grid
+        self.date_axis = DateAxis(self.bottom_date, self.top_date, self.top_grid, self.options.bottom_grid)
+        self.top_label_y = self.top_grid + 5         # y coordinate of where the top labels are placed
+        self.label_index = LabelIndex() if self.options.declutter else None
+        self.events = []
+
+        self.weekday_left_grid = self.options.left_grid + 250
+        self.weekday_right_grid = self.weekday_left_grid + self.options.weekday_hour_width*(self.options.weekday_end_hour-self.options.weekday_start_hour) # Where the weekdays end
+        self.weekend_right_grid = self.weekday_right_grid + (32/260 * self.options.weekday_hour_width / (7/365))                                 # Where the weekends end
+
+        self.age_left = self.weekend_right_grid          # x coordinate of where the placement of the ages starts
+        self.age_right = self.weekend_right_grid + 35    # x coordinate of the right border for ages
+        self.event_line_x = self.weekend_right_grid + 50 # x coordinate of the event line
+
+        # The grid is the same for every biograph of the same timespan and options, so it is drawn once (see GridCache).
+        # svgwrite drawings cannot share elements, and decluttered grid labels have to go into the label index.
+        if not isinstance(self.dwg, SvgStream) or self.label_index is not None:
+            return self.draw_grid(end_isodate)
+
+        key = grid_cache.key(start_isodate, end_isodate, self.timeline_options)
+        elements = grid_cache.get(key)
+        if elements is None:
+            dwg, self.dwg = self.dwg, SvgRecorder()
+            try:
+                self.draw_grid(end_isodate)
+            finally:
+                dwg, self.dwg = self.dwg, dwg
+            elements = dwg.elements
+            grid_cache.put(key, elements)
+        elif self.options.legend:
+            self.width_from_hours(150, 100)     # settles options.weekday_hour_width, as drawing the legend does
+        for element in elements:
+            self.dwg.add(element)
+
+    def draw_grid(self, end_isodate):
+        'Draws the grid set up by timespan(): year ticks, ages, axis labels, the legend and the event line.'
+
+        # Set year ticks on y-axis
+        for y in range(self.bottom_date.year, self.top_date.year+1):
+            dt = self.parse_date('%04d-01-01' % y)
+            self.line(0, dt, self.options.left_grid, dt)
+            self.text(0, dt-2, y, class_='yeartick')
+
+        # Set ages on y-axis
+        age = 0
+        for y in range(self.bottom_date.year, self.top_date.year):
+            g = self.dwg.g(class_='age')
+            dt   = self.parse_date('%04d-%02d-%02d' % (y, self.bottom_date.month, self.bottom_date.day))
+            endt = self.parse_date('%04d-%02d-%02d' % (y+1, self.bottom_date.month, self.bottom_date.day))
+            self.rectangle(self.age_left, dt, self.age_right, endt, parent=g)
+            if age > 0:
+                self.text_center(self.age_left, dt, self.age_right, endt, str(age), parent=g, class_='age')
+            self.dwg.add(g)
+            age += 1
+
+
+        # Set labels on horizontal axis
+        # Coordinates
+        morning_start   = self.weekday_hour(self.options.weekday_start_hour)
+        afternoon_start = self.weekday_hour(12)
+        evening_start   = self.weekday_hour(18)
+        day_end         = self.weekday_hour(self.options.weekday_end_hour)
+
+        # Drawing
+        # Monday to Friday
+        label1_y = self.top_grid-20
+        label2_y = self.top_grid-4
+        label_y = mid(label1_y, label2_y)
+        self.text(mid(morning_start, afternoon_start)-50, label1_y, 'weekday', class_="axis_label")
+        self.text(mid(morning_start, afternoon_start)-50, label2_y, 'mornings', class_="axis_label")
+        self.text(mid(afternoon_start, evening_start)-50, label1_y, 'weekday', class_="axis_label")
+        self.text(mid(afternoon_start, evening_start)-50, label2_y, 'afternoons', class_="axis_label")
+        self.text(mid(evening_start, day_end)-50, label1_y, 'weekday', class_="axis_label")
+        self.text(mid(evening_start, day_end)-50, label2_y, 'evenings', class_="axis_label")
+        self.line(morning_start, self.top_label_y, morning_start-1, self.top_grid-50)
+        self.line(afternoon_start, self.top_label_y, afternoon_start - 1, self.top_grid-30)
+        self.line(evening_start, self.top_label_y, evening_start-1, self.top_grid-30)
+
+        # Saturday to Sunday
+        self.text(mid(day_end, self.weekend_right_grid)-50, label_y, 'weekends', class_="axis_label")
+        self.line(day_end, self.top_label_y, day_end, self.top_grid-50)
+        self.line(self.weekend_right_grid-1, self.top_label_y, self.weekend_right_grid-1, self.top_grid-50)
+
+        # ZzzzzzZZZ
+        self.text(mid(self.options.left_grid, self.weekday_left_grid)-125, label_y, 'residences', class_="axis_label")
+        self.text(morning_start-70, label_y, 'flatmates', class_="axis_label")
+        self.line(self.weekday_left_grid, self.top_label_y, self.weekday_left_grid, self.top_grid-50)
+
+        # Legend
+        if self.options.legend:
+            legend_x1 = mid(self.options.left_grid, self.weekday_left_grid)-130
+            legend_x2 = legend_x1 + self.width_from_hours(150,100)
+            legend_y1 = self.options.top_grid - 55
+            legend_y2 = legend_y1 + (self.parse_date('%04d-05-30' % (self.top_date.year+1)) - self.parse_date('%04d-12-28' % self.top_date.year))
+            self.rectangle(legend_x1-20, legend_y1+10, legend_x2+55, legend_y2-14, class_='legend')
+            self.rectangle(legend_x1, legend_y1+3, legend_x2, legend_y2+3, class_="scale")
+            self.text(legend_x1-15, legend_y2-3, '5 hours/week')
+            self.text(legend_x2+3, legend_y2+18, '20 weeks')
+            self.text(legend_x1+3, legend_y1-8, '100')
+            self.text(legend_x1-1, legend_y1+1, 'hours')
+
+        # Draw the event line
+        self.text(self.age_right, label_y, 'events', class_="axis_label")
+        self.line(self.event_line_x, self.top_grid, self.event_line_x, self.options.bottom_grid)
+
+        self.text(self.weekend_right_grid+20, 15, 'Generated on ' + end_isodate)
+
+    ## No matter the nature of memories, they all end up here.
+    def remember(self, type, intensity, label, start_isodate, end_isodate=None, weekday_start_hour=None, weekday_end_hour=None, hours=None, **kwargs):
+        '''Saves a memory, to be written as a blueprint row by print_to_tsv().
+        Memories are kept as they are given (see Memory), and only serialized when written.'''
+
+        self.saved_memories.append(Memory(type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs or None))
+
+    def memory_color(self, type, intensity, label, **kwargs):
+        '''Returns the css color of a memory and the label to draw it with.
+        Repeated homes and events keep their first colour and are drawn without a label.'''
+
+        # Weekly
+        if type not in ['home', 'event']:
+            return color_palette[type] + str(intensity), label
+
+        # Homes we keep returning to are going to be assigned the same colour
+        colors = self.residence_colors if type == 'home' else self.event_colors
+        if label not in colors:
+            colors[label] = color_palette[type] + str(len(colors)+1)
+            color = colors[label]
+        else:
+            color = colors[label]
+            label = ''
+        if 'class_' in kwargs:
+            color = 'blerg'
+        return color, label
 
-        elif type == 'timespan':
-            timespan(start_isodate, end_isodate)
+    def generic(self, type, intensity, label, start_isodate, end_isodate=None, weekday_start_hour=None, weekday_end_hour=None, hours=None, **kwargs):
+        'Processes all of the memories and sends them to the appropriate drawer'
 
-        elif type in ['home', 'event']:
-            generic(type, 0, label, start_isodate, end_isodate, **kwargs)
+        self.remember(type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+        kwargs.pop('title', None)
 
-        # ... then process the rest
-        else:
-            generic(type, int(intensity), label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+        # Do nuffin
+        if type in ['timespan', 'option']:
+            return
 
-def setup_dwg(fn):
-    'Sets up the svg drawing tool.'
+        color, label = self.memory_color(type, intensity, label, **kwargs)
+        return self.draw(type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
 
-    global dwg
+    def draw(self, type, color, label, start_isodate, end_isodate=None, weekday_start_hour=None, weekday_end_hour=None, hours=None, **kwargs):
+        'Sends a memory, already coloured by memory_color(), to the appropriate drawer'
 
-    dwg = svgwrite.Drawing(fn, preserveAspectRatio='xMidYMid meet')
-    dwg.add_stylesheet('biograph.css', title='base devotees css')
-    dwg.add_stylesheet('personal.css', title='user custom css')
+        if type in ['home']:
+            return self.residence(color, label, start_isodate, end_isodate, **kwargs)
+        if type in ['event']:
+            return self.occurrence(color, label, start_isodate, end_isodate, **kwargs)
 
-    pattern1 = dwg.defs.add(dwg.pattern(size=(20, 20), id="pattern1", patternUnits="userSpaceOnUse"))
-    pattern1.add(dwg.rect((0, 0), (20, 20)))
-    pattern1.add(dwg.line((0, 20), (20, 0)))
+        # Weekly
+        if type in ['roommate']:
+            return self.sleepmate(color, label, start_isodate, end_isodate or self.top_isodate, **kwargs)
+        if not hours:
+            return self.weekday(color, label, start_isodate, end_isodate or self.top_isodate, weekday_start_hour, weekday_end_hour, **kwargs)
+        else:
+            return self.weekend(color, label, start_isodate, end_isodate or self.top_isodate, hours, **kwargs)
+
+
+    ## Many memories at once
+    def layout_memories(self, memories):
+        '''Lays out a batch of memories in a few vectorized numpy passes instead of one generic() call each.
+        memories: list of (type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs).
+        Returns the finished geometry as (drawer, args, kwargs) in blueprint order, see draw_layout().'''
+
+        import numpy as np
+
+        # Columns
+        kinds, colors, labels, starts, ends, start_hours, end_hours, hours_per_week, slots, extras = [], [], [], [], [], [], [], [], [], []
+        for type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs in memories:
+            self.remember(type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+            kwargs.pop('title', None)
+            color, label = self.memory_color(type, intensity, label, **kwargs)
+
+            if type in ['home']:
+                kind = RESIDENCE
+            elif type in ['event']:
+                kind = OCCURRENCE
+            elif type in ['roommate']:
+                kind = SLEEPMATE
+            elif not hours:
+                kind = WEEKDAY
+                if weekday_start_hour in (None, '') or weekday_end_hour in (None, ''):
+                    raise TypeError('weekday memory %r needs weekday_start and weekday_end hours' % label)
+            else:
+                kind = WEEKEND
+
+            kinds.append(kind)
+            colors.append(color)
+            labels.append(label)
+            starts.append(start_isodate)
+            ends.append(end_isodate if kind == OCCURRENCE else end_isodate or self.top_isodate)
+            start_hours.append(weekday_start_hour if kind == WEEKDAY else 0)
+            end_hours.append(weekday_end_hour if kind == WEEKDAY else 0)
+            hours_per_week.append(hours if kind == WEEKEND else 0)
+            slots.append(kwargs.pop('slot', 0) if kind in (SLEEPMATE, WEEKEND) else 0)
+            extras.append(kwargs)
+
+        n = len(kinds)
+        kind = np.array(kinds)
+        residences, occurrences, sleepmates, weekdays, weekends = (kind == k for k in range(5))
+
+        # Input Quality
+        start_dates, end_dates = np.array(starts, dtype=str), np.array(ends, dtype=str)
+        in_order = np.where(occurrences, start_dates <= end_dates, start_dates < end_dates)
+        if not in_order.all():
+            i = int(np.argmin(in_order))
+            raise AssertionError((starts[i], ends[i]))
+
+        # Every distinct date is parsed only once
+        unique_dates, inverse = np.unique(np.concatenate([start_dates, end_dates]), return_inverse=True)
+        ordinals = np.array([self.date_axis.ordinal(d) for d in unique_dates.tolist()], dtype=np.int64)[inverse]
+        start_ordinals, end_ordinals = ordinals[:n], ordinals[n:]
+        ys = self.date_axis.bottom_y - self.date_axis.scale*(self.date_axis.days_alive-(self.date_axis.top_ordinal-ordinals))
+        y1, y2 = ys[:n], ys[n:]
+
+        # Coordinates, mirroring residence(), weekday(), sleepmate() and weekend()
+        x1 = np.zeros(n)
+        x2 = np.zeros(n)
+        x1[residences] = self.options.left_grid
+        x2[residences] = self.weekend_right_grid
+
+        x_scale = (self.weekday_right_grid-self.weekday_left_grid) / (self.options.weekday_end_hour-self.options.weekday_start_hour)
+        start_hour = np.array(start_hours, dtype=float)
+        end_hour = np.array(end_hours, dtype=float)
+        x1[weekdays] = self.weekday_left_grid + (start_hour[weekdays]-self.options.weekday_start_hour) * x_scale
+        x2[weekdays] = self.weekday_left_grid + (end_hour[weekdays]-self.options.weekday_start_hour) * x_scale
+
+        slot = np.array(slots, dtype=float)
+        if sleepmates.any():
+            roommate_width = self.width_from_hours(7, 2)
+            x1[sleepmates] = self.weekday_left_grid - (roommate_width*(slot[sleepmates])+15)
+            x2[sleepmates] = x1[sleepmates] + roommate_width
+
+        if weekends.any():
+            self.width_from_hours(7, 2) # settles options.weekday_hour_width
+            hour_width = self.options.weekday_hour_width
+            slot = np.clip(slot[weekends], 0, 4)
+            num_days = end_ordinals[weekends] - start_ordinals[weekends]
+            num_hours = np.array(hours_per_week, dtype=float)[weekends] * num_days / 7
+            assert (num_hours <= (num_days*16)).all()
+            if not num_days.all():
+                raise ZeroDivisionError('weekend memory lasting zero days')
+            x1[weekends] = self.weekday_right_grid + 1 + ((slot*2)/260) * hour_width / (2/365)
+            x2[weekends] = x1[weekends] + (num_hours/260) * hour_width / (num_days/365)
+
+        # Label anchors, mirroring label_anchor(), text_left() and dot()
+        label_x = (x1 + (x2-self.underhang_offset)) / 2
+        label_y = (y1 + y2) / 2 + self.underhang_offset
+        label_length = np.array([len(label) for label in labels])
+        vert = (np.abs(y2-y1) > np.abs(x2-x1)) & (label_length*10 > np.abs(x2-x1))
+        label_x[residences] = self.options.left_grid
+        label_y[residences] = ((y1[residences]-8) + (y1[residences]-15)) / 2 + 10
+        label_y[occurrences] = (y1[occurrences] + y2[occurrences]) / 2
+
+        # Hand the finished geometry over to the drawers
+        layout = []
+        rows = zip(kinds, colors, labels, x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist(), label_x.tolist(), label_y.tolist(), vert.tolist(), extras)
+        for kind, color, label, x1, y1, x2, y2, label_x, label_y, vert, kwargs in rows:
+            add_class(kwargs, color)
+            if kind == OCCURRENCE:
+                layout.append((self.hold_event if self.options.cluster_events else self.dot, (self.event_line_x, label_y, label), kwargs))
+            elif kind == RESIDENCE:
+                add_class(kwargs, 'residence')
+                layout.append((self.rectangle, (x1, y1, x2, y2), kwargs))
+                if label:
+                    layout.append((self.text, (label_x, label_y, label), {}))
+            else:
+                layout.append((self.box, (x1, y1, x2, y2, label, label_x, label_y, vert), kwargs))
+        return layout
+
+    def pack_slots(self, memories):
+        '''Gives every roommate and weekend memory without a slot the lowest slot of its column that is free for all of its time.
+        A weekend memory is as wide as one slot per 7 hours a week, so it takes that many slots from its own, and gets
+        the lowest slot it fits in whole before weekend() clamps slots to 4, or else the least crowded one.
+        Memories are swept by start date, so the fewest slots needed are used; manual slots are kept, and packed around.
+        memories: list of (type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs),
+        whose kwargs get the slots.'''
+
+        ordinal = self.date_axis.ordinal
+        columns = {SLEEPMATE: [], WEEKEND: []}
+        for type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs in memories:
+            if type == 'roommate':
+                kind, width = SLEEPMATE, 1
+            elif type not in ['home', 'event', 'option', 'timespan'] and hours:
+                kind, width = WEEKEND, max(1, int(-(-float(hours) // 7)))
+            else:
+                continue
+            columns[kind].append((ordinal(start_isodate), ordinal(end_isodate or self.top_isodate), width, kwargs))
+
+        for kind, column in columns.items():
+            last_slot = 4 if kind == WEEKEND else None
+
+            # Manual slots, sorted by start, with the latest end so far to find overlaps by bisection
+            manual = collections.defaultdict(list)
+            for start, end, width, kwargs in column:
+                if 'slot' in kwargs:
+                    first = int(kwargs['slot']) if last_slot is None else min(max(int(kwargs['slot']), 0), last_slot)
+                    for slot in range(first, first + width):
+                        manual[slot].append((start, end))
+            taken = {}
+            for slot, spans in manual.items():
+                spans.sort()
+                taken[slot] = ([start for start, end in spans], list(itertools.accumulate((end for start, end in spans), max)))
+
+            def is_taken(slot, start, end):
+                if slot not in taken:
+                    return False
+                starts, latest_ends = taken[slot]
+                i = bisect.bisect_left(starts, end)
+                return i > 0 and latest_ends[i-1] > start
+
+            # Sweep line: slots of memories that ended are free again
+            drawn = []                              # heap of (end, slot, width)
+            crowd = collections.Counter()           # slot: number of memories drawn over it
+            fits = lambda slot, width, start, end: all(not crowd[s] and not is_taken(s, start, end) for s in range(slot, slot + width))
+            for start, end, width, kwargs in sorted((m for m in column if 'slot' not in m[3]), key=lambda m: (m[0], m[1])):
+                while drawn and drawn[0][0] <= start:
+                    _, first, n = heapq.heappop(drawn)
+                    crowd.subtract(range(first, first + n))
+
+                if last_slot is None:
+                    slot = next(s for s in itertools.count() if fits(s, width, start, end))
+                else:
+                    candidates = range(max(0, last_slot + 1 - width) + 1)
+                    slot = next((s for s in candidates if fits(s, width, start, end)), None)
+                    if slot is None:
+                        slot = min(candidates, key=lambda s: sum(crowd[t] + is_taken(t, start, end) for t in range(s, s + width)))
+
+                kwargs['slot'] = slot
+                heapq.heappush(drawn, (end, slot, width))
+                crowd.update(range(slot, slot + width))
+
+    def packed(self, rows):
+        '''Passes rows on as they come, unless the pack_slots option is on by the first memory:
+        then the rest of the rows are read at once, to pack their slots (see pack_slots()).'''
+
+        rows = iter(rows)
+        for row in rows:
+            if row[0] in ['option', 'timespan'] or not self.options.pack_slots:
+                yield row
+            else:
+                rest = [row] + list(rows)
+                self.pack_slots(rest)
+                yield from rest
+
+    def draw_layout(self, layout):
+        'Draws the geometry computed by layout_memories().'
+
+        for drawer, args, kwargs in layout:
+            drawer(*args, **kwargs)
+
+
+    ## The nature of memories
+    def event(self, name, start_isodate, end_isodate, *args, **kwargs):
+        'What were the key events or landmarks in your life?'
+        return self.generic('event', 0, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def school(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'Where did you study?'
+        return self.generic('school', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def work(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'How have you made a living?'
+        return self.generic('work', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def play(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'When were some moments you stepped back and did something without a goal in mind?'
+        return self.generic('play', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def project(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'Which sort of endeavours did you undertake?'
+        return self.generic('project', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def love(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'With whom have you written a shared story?'
+        return self.generic('love', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def friend(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'Who have you met along the way that has made the journey more pleasant.'
+        return self.generic('friend', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def roommate(self, intensity, name, start_isodate, end_isodate, *args, **kwargs):
+        'With whom have you lived with?'
+        return self.generic('roommate', intensity, name, start_isodate, end_isodate, *args, **kwargs)
+
+    def home(self, name, start_isodate, end_isodate, **kwargs):
+        'Where have you lived?'
+        return self.generic('home', 0, name, start_isodate, end_isodate, **kwargs)
+
+
+    ## Where the magic begins
+    def print_to_tsv(self, fn):
+        'Constructs a blueprint.tsv file out of biograph function calls.'
+
+        with open(fn, 'w', encoding='utf-8') as fp:
+            fp.write('\t'.join(headers) + '\n')
+            for memory in self.saved_memories:
+                fp.write('\t'.join(memory.fields()) + '\n')
+
+    def tsv_to_svg(self, fn_tsv, vectorized=False):
+        '''Draws a biograph.svg based off of a blueprint.tsv, which can also be given as an open file.
+        If vectorized, memories are laid out in batches by layout_memories() (requires numpy).
+        Returns the number of memories in the blueprint.'''
+
+        def rows():
+            for fields in read_tsv(fn_tsv):
+                if self.options.debug:
+                    print('\t'.join(fields))
+                yield parse_memory(fields)
+
+        return self.draw_rows(rows(), vectorized)
+
+    def bgb_to_svg(self, fn_bgb, vectorized=False, pack=True):
+        '''Draws a biograph.svg based off of a binary blueprint.bgb (see BinaryBlueprint).
+        Unless pack, slots are left as they are even with the pack_slots option on, as when replaying a Python blueprint.
+        Returns the number of memories in the blueprint.'''
+
+        with BinaryBlueprint(fn_bgb) as blueprint:
+            return self.draw_rows(blueprint.rows(), vectorized, pack=pack)
+
+    def draw_rows(self, rows, vectorized=False, batch_size=1<<16, pack=True):
+        '''Draws blueprint rows, as split up by parse_memory(), as they come.
+        If vectorized, memories are laid out in batches of up to batch_size by layout_memories() (requires numpy).
+        If pack, slots are packed with the pack_slots option on (see packed()).
+        Returns the number of rows.'''
+
+        batch = []
+        num_rows = 0
+        for row in self.packed(rows) if pack else rows:
+            num_rows += 1
+
+            # Options and timespans change the grid, so memories batched so far are drawn first
+            if row[0] in ['option', 'timespan']:
+                if batch:
+                    self.draw_layout(self.layout_memories(batch))
+                    batch = []
+                self.draw_row(*row)
+            elif vectorized:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.draw_layout(self.layout_memories(batch))
+                    batch = []
+            else:
+                self.draw_row(*row)
 
-    pattern2 = dwg.defs.add(dwg.pattern(size=(8, 8), id="pattern2", patternUnits="userSpaceOnUse"))
-    pattern2.add(dwg.rect((0, 0), (8, 8)))
-    pattern2.add(dwg.circle((4, 4), 1))
+        if batch:
+            self.draw_layout(self.layout_memories(batch))
 
-    pattern3 = dwg.defs.add(dwg.pattern(size=(20, 20), id="pattern3", patternUnits="userSpaceOnUse"))
-    pattern3.add(dwg.rect((0, 0), (20, 20)))
-    pattern3.add(dwg.line((0, 20), (20, 0)))
-    pattern3.add(dwg.line((0, 0), (20, 20)))
+        return num_rows
+
+    def draw_row(self, type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs):
+        'Draws a blueprint.tsv row, as split up by parse_memory().'
 
-    pattern4 = dwg.defs.add(dwg.pattern(size=(20, 20), id="pattern4", patternUnits="userSpaceOnUse"))
-    pattern4.add(dwg.rect((0, 0), (20, 20)))
-    pattern4.add(dwg.line((10, 0), (10, 20)))
+        # First handle the special cases ...
+        if type == 'option':
+            assert label in self.timeline_options, label
+            self.timeline_options[label] = option_value(label, start_isodate) # current container for the option value
 
-    pattern5 = dwg.defs.add(dwg.pattern(size=(20, 20), id="pattern5", patternUnits="userSpaceOnUse"))
-    pattern5.add(dwg.rect((0, 0), (20, 20)))
-    pattern5.add(dwg.line((0, 20), (20, 20)))
+        elif type == 'timespan':
+            self.timespan(start_isodate, end_isodate)
 
+        # ... then process the rest
+        else:
+            self.generic(type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+
+    def setup_dwg(self, fn, stream=False, tiled=False, thumbnail=None, compact=False):
+        '''Sets up the svg drawing tool.
+        If stream, elements are written to fn as they are drawn (see SvgStream) instead of being kept in an svgwrite.Drawing until dwg.save().
+        If tiled, fn is a directory that elements are cut up into by dwg.save_tiles() (see SvgTiles).
+        If thumbnail is a (width, height), fn is a png painted by dwg.save() (see SvgRaster); a height of None keeps the aspect ratio.
+        Otherwise, if compact, a smaller svg (or gzipped .svgz) that draws the same is written by dwg.save() (see SvgCompact).'''
+
+        if thumbnail:
+            self.dwg = SvgRaster(fn, *thumbnail, preserveAspectRatio='xMidYMid meet')
+        elif compact:
+            self.dwg = SvgCompact(fn, preserveAspectRatio='xMidYMid meet')
+        elif tiled:
+            self.dwg = SvgTiles(fn, preserveAspectRatio='xMidYMid meet')
+        elif stream:
+            self.dwg = SvgStream(fn, preserveAspectRatio='xMidYMid meet')
+        else:
+            import svgwrite
+            self.dwg = svgwrite.Drawing(fn, preserveAspectRatio='xMidYMid meet')
+        self.dwg.add_stylesheet('biograph.css', title='base devotees css')
+        self.dwg.add_stylesheet('personal.css', title='user custom css')
+
+        for pattern in pattern_defs() if isinstance(self.dwg, SvgStream) else draw_patterns(self.dwg):
+            self.dwg.defs.add(pattern)
+
+        # Events held back by the cluster_events option are drawn however the drawing gets saved
+        save = self.dwg.save
+        def save_events(*args, **kwargs):
+            self.flush_events()
+            return save(*args, **kwargs)
+        self.dwg.save = save_events
+
+    def render_blueprint(self, fn_tsv, fn_svg, stream=False, vectorized=False):
+        '''Draws fn_svg based off of the blueprint fn_tsv (or a binary blueprint.bgb), starting from a clean slate.
+        Returns the number of memories drawn.'''
+
+        self.reset()
+        self.setup_dwg(fn_svg, stream)
+        if fn_tsv.endswith('.bgb'):
+            num_memories = self.bgb_to_svg(fn_tsv, vectorized)
+        else:
+            num_memories = self.tsv_to_svg(fn_tsv, vectorized)
+        self.dwg.save()
+        return num_memories
+
+    def render_bundle(self, fn_tsv, fn_out, compact=False, vectorized=False):
+        '''Draws the blueprint fn_tsv (or a binary blueprint.bgb) as a single file that needs no other, starting from a clean slate:
+        an svg (or gzipped .svgz) with its stylesheets inlined (see bundle_svg()), or a web page if fn_out is a .html.
+        Stylesheets next to fn_out are inlined over those next to biograph.py.
+        Returns the number of memories drawn.'''
+
+        self.reset()
+        out = io.StringIO()
+        self.setup_dwg(out, stream=True, compact=compact)
+        if fn_tsv.endswith('.bgb'):
+            num_memories = self.bgb_to_svg(fn_tsv, vectorized)
+        else:
+            num_memories = self.tsv_to_svg(fn_tsv, vectorized)
+        self.dwg.save()
+
+        css = []
+        here = os.path.dirname(os.path.abspath(__file__))
+        for fn_css in ['biograph.css', 'personal.css']:
+            for directory in [os.path.dirname(os.path.abspath(fn_out)), here]:
+                if os.path.exists(os.path.join(directory, fn_css)):
+                    with open(os.path.join(directory, fn_css), encoding='utf-8') as fp:
+                        css.append(fp.read())
+                    break
+
+        svg = bundle_svg(out.getvalue(), '\n'.join(css))
+        if fn_out.endswith('.html'):
+            svg = bundle_html(svg)
+        if fn_out.endswith('.svgz'):
+            import gzip
+            with gzip.GzipFile(fn_out, 'wb', mtime=0) as fp:
+                fp.write(svg.encode('utf-8'))
+        else:
+            with open(fn_out, 'w', encoding='utf-8') as fp:
+                fp.write(svg)
+        return num_memories
+
+    def tile_levels(self, years_per_tile=10, zoom=2):
+        '''Returns the (scale, bands) levels of detail to cut the biograph into, from the most detailed one to the coarsest.
+        The bands of the first level are years_per_tile years, starting at round years; every next level is zoom times coarser,
+        until a single band holds the whole biograph, as it does once the bands are as many years as the biograph spans;
+        levels cut into the same bands as the one before are left out. Bands are (name, y1, y2), named after their first year;
+        the first band also holds the headers above the grid, the last one the space below.'''
+
+        height = self.options.bottom_grid + 50
+        span_years = self.top_date.year - self.bottom_date.year + 1
+        levels = []
+        scale, years = 1, years_per_tile
+        while True:
+            # Later years are drawn higher up
+            starts = [y for y in range(self.bottom_date.year + 1, self.top_date.year + 1) if y % years == 0] if years < span_years else []
+            names = [self.bottom_date.year] + starts
+            ys = [height] + [self.parse_date('%04d-01-01' % y) for y in starts] + [0]
+            bands = [(str(name), ys[i+1], ys[i]) for i, name in enumerate(names)]
+            if not levels or bands[::-1] != levels[-1][1]:
+                levels.append((scale, bands[::-1]))
+            if len(bands) == 1:
+                return levels
+            scale, years = scale * zoom, years * zoom
+
+    def render_tiles(self, fn_tsv, outdir, years_per_tile=10, zoom=2, vectorized=False):
+        '''Draws the blueprint fn_tsv (or a binary blueprint.bgb) as tiles of years_per_tile years into outdir, starting from a clean slate.
+        Coarser overview tiles are drawn at every zoom level (see tile_levels()), and listed with them in manifest.json.
+        With the cluster_events option, every level gets its own clusters of events (see draw_events()).
+        tiles.html is copied along as outdir/index.html to view them, loading only the tiles in sight, together with the stylesheets.
+        Returns the manifest.'''
+
+        self.reset()
+        self.setup_dwg(outdir, tiled=True)
+        if fn_tsv.endswith('.bgb'):
+            self.bgb_to_svg(fn_tsv, vectorized)
+        else:
+            self.tsv_to_svg(fn_tsv, vectorized)
+
+        # Clustered events are drawn for every level, clustered as far as it is zoomed out
+        levels = self.tile_levels(years_per_tile, zoom)
+        if self.events:
+            for scale, bands in levels:
+                self.draw_events(scale)
+            self.events = []
+        manifest = self.dwg.save_tiles(levels)
+
+        # The viewer, and the stylesheets unless personalised ones are already there
+        import shutil
+        here = os.path.dirname(os.path.abspath(__file__))
+        shutil.copy(os.path.join(here, 'tiles.html'), os.path.join(outdir, 'index.html'))
+        for fn_css in ['biograph.css', 'personal.css']:
+            if not os.path.exists(os.path.join(outdir, fn_css)):
+                shutil.copy(os.path.join(here, fn_css), os.path.join(outdir, fn_css))
+        return manifest
+
+
+## The default biograph, drawn by the module-level functions
+default_biograph = Biograph(timeline_options)
+residence_colors = default_biograph.residence_colors
+saved_memories = default_biograph.saved_memories
+event_colors = default_biograph.event_colors
+
+reset = default_biograph.reset
+private, wrap_link, add_obj = default_biograph.private, default_biograph.wrap_link, default_biograph.add_obj
+parse_date, width_from_hours, weekday_hour = default_biograph.parse_date, default_biograph.width_from_hours, default_biograph.weekday_hour
+text, text_left, text_center, label_anchor = default_biograph.text, default_biograph.text_left, default_biograph.text_center, default_biograph.label_anchor
+line, rectangle, box, dot = default_biograph.line, default_biograph.rectangle, default_biograph.box, default_biograph.dot
+occurrence, weekday, sleepmate = default_biograph.occurrence, default_biograph.weekday, default_biograph.sleepmate
+weekend, residence, timespan = default_biograph.weekend, default_biograph.residence, default_biograph.timespan
+remember, memory_color, generic, draw = default_biograph.remember, default_biograph.memory_color, default_biograph.generic, default_biograph.draw
+layout_memories, draw_layout = default_biograph.layout_memories, default_biograph.draw_layout
+event, school, work, play, project = default_biograph.event, default_biograph.school, default_biograph.work, default_biograph.play, default_biograph.project
+love, friend, roommate, home = default_biograph.love, default_biograph.friend, default_biograph.roommate, default_biograph.home
+print_to_tsv, tsv_to_svg, bgb_to_svg = default_biograph.print_to_tsv, default_biograph.tsv_to_svg, default_biograph.bgb_to_svg
+draw_rows, draw_row, setup_dwg, flush_events = default_biograph.draw_rows, default_biograph.draw_row, default_biograph.setup_dwg, default_biograph.flush_events
+render_blueprint = default_biograph.render_blueprint
+
+def __getattr__(name):
+    'Module attributes set while drawing, such as dwg, options and top_date, are those of the default biograph.'
+
+    return getattr(default_biograph, name)
+
+
+## Binary blueprints
+class BinaryBlueprint:
+    '''A memory-mapped binary blueprint.bgb: the columns of a blueprint.tsv stored as typed arrays.
+
+    After a fixed header come, each padded to 8 bytes:
+      types      uint32[num_types]   string ids of the memory types used in the blueprint
+      type       uint8[num_rows]     index into types
+      intensity  int8[num_rows]      -1 if empty
+      label, href, title, rest       uint32[num_rows] string ids each
+      start_date, end_date           int32[num_rows] day ordinals; 0 if empty, -(string id + 1) if not YYYY-MM-DD
+      weekday_start, weekday_end, weekend_hours, slot   float64[num_rows], NaN if empty
+      string offsets                 uint64[num_strings + 1] into the utf-8 string table that follows
+    Every distinct string is stored once, and string id 0 is the empty string.'''
+
+    magic = b'BIOGRAPH'
+    version = 1
+    header = struct.Struct('<8sIIIIQ') # magic, version, num_rows, num_types, num_strings, string table bytes
+    columns = [('type', 'B'), ('intensity', 'b'), ('label', 'I'), ('href', 'I'), ('title', 'I'), ('rest', 'I'),
+               ('start_date', 'i'), ('end_date', 'i'),
+               ('weekday_start', 'd'), ('weekday_end', 'd'), ('weekend_hours', 'd'), ('slot', 'd')]
+
+    def __init__(self, fn):
+        assert sys.byteorder == 'little', 'binary blueprints are little-endian'
+        self.fp = open(fn, 'rb')
+        import mmap
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = buf = memoryview(self.mm)
+        magic, version, self.num_rows, num_types, num_strings, num_string_bytes = self.header.unpack_from(buf)
+        assert magic == self.magic and version == self.version, (magic, version)
+
+        # Columns are views straight into the mapped file
+        offset = self.header.size
+        self.types, offset = self.column(buf, offset, 'I', num_types)
+        for name, typecode in self.columns:
+            column, offset = self.column(buf, offset, typecode, self.num_rows)
+            setattr(self, name, column)
+        self.string_offsets, offset = self.column(buf, offset, 'Q', num_strings + 1)
+        self.string_table = buf[offset:offset+num_string_bytes]
+        self.strings = {}
+
+    @staticmethod
+    def column(buf, offset, typecode, n):
+        'Returns the typed memoryview of n items at offset in buf, and the offset after it.'
+
+        size = n * struct.calcsize(typecode)
+        return buf[offset:offset+size].cast(typecode), offset + (size + 7) // 8 * 8
+
+    def close(self):
+        for name in ['types', 'string_offsets', 'string_table'] + [name for name, _ in self.columns]:
+            getattr(self, name).release()
+        self.buf.release()
+        self.mm.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, i):
+        'Returns string i of the string table, decoding it only the first time.'
+
+        s = self.strings.get(i)
+        if s is None:
+            s = self.strings[i] = str(self.string_table[self.string_offsets[i]:self.string_offsets[i+1]], 'utf-8')
+        return s
+
+    def date(self, d):
+        if d > 0:
+            return ordinal_isodate(d)
+        return self.string(-d-1) if d else ''
+
+    def rows(self):
+        '''Yields each row as parse_memory() would split it up, without parsing any text:
+        dates are formatted once per distinct day, and each distinct rest is json decoded once.'''
+
+        import json
+        types = [self.string(i) for i in self.types]
+        rests = {}
+        number = lambda x: '' if x != x else x
+        for i in range(self.num_rows):
+            type = types[self.type[i]]
+            intensity = self.intensity[i]
+            if type in ['home', 'event']:
+                intensity = 0
+            elif type in ['option', 'timespan']:
+                intensity = '' if intensity < 0 else str(intensity)
+
+            kwargs = {}
+            if self.href[i]:  kwargs['href'] = self.string(self.href[i])
+            if self.title[i]: kwargs['title'] = self.string(self.title[i])
+            if self.slot[i] == self.slot[i]: kwargs['slot'] = self.slot[i]
+            if self.rest[i]:
+                if self.rest[i] not in rests:
+                    rests[self.rest[i]] = json.loads(self.string(self.rest[i]))
+                kwargs.update(rests[self.rest[i]])
+
+            yield (type, intensity, self.string(self.label[i]), self.date(self.start_date[i]), self.date(self.end_date[i]),
+                   number(self.weekday_start[i]), number(self.weekday_end[i]), number(self.weekend_hours[i]), kwargs)
+
+    def tsv_rows(self):
+        'Yields each row as the list of blueprint.tsv fields.'
+
+        number = lambda x: '' if x != x else str(int(x)) if x.is_integer() else repr(x)
+        for i in range(self.num_rows):
+            yield [self.string(self.types[self.type[i]]), '' if self.intensity[i] < 0 else str(self.intensity[i]),
+                   self.string(self.label[i]), self.date(self.start_date[i]), self.date(self.end_date[i]),
+                   number(self.weekday_start[i]), number(self.weekday_end[i]), number(self.weekend_hours[i]),
+                   self.string(self.href[i]), self.string(self.title[i]), number(self.slot[i]), self.string(self.rest[i])]
+
+@functools.lru_cache(maxsize=1<<16)
+def ordinal_isodate(ordinal):
+    'Returns the isodate (YYYY-MM-DD) of a day ordinal.'
+
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+def day_ordinal(isodate):
+    'Returns the day ordinal of an isodate, or of any other date that parse_datetime() understands.'
+
+    return isodate_ordinal(isodate) or parse_datetime(isodate).toordinal()
+
+def tsv_to_bgb(fn_tsv, fn_bgb):
+    '''Converts a blueprint.tsv into a binary blueprint.bgb.
+    Returns the number of rows.'''
+
+    return rows_to_bgb(read_tsv(fn_tsv), fn_bgb)
+
+def rows_to_bgb(rows, fn_bgb):
+    '''Writes blueprint rows, as lists of tsv fields, into a binary blueprint.bgb.
+    Returns the number of rows.'''
+
+    strings = {'': 0}
+    intern = lambda s: strings.setdefault(s, len(strings))
+    number = lambda s: float(s) if s else float('nan')
+    date = lambda s: isodate_ordinal(s) or (-intern(s)-1 if s else 0)
+    types = {}
+    columns = {name: array.array(typecode) for name, typecode in BinaryBlueprint.columns}
+
+    for fields in rows:
+        type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, href, title, slot, rest = fields
+        columns['type'].append(types.setdefault(type, len(types)))
+        columns['intensity'].append(int(intensity) if intensity else -1)
+        columns['label'].append(intern(label))
+        columns['href'].append(intern(href))
+        columns['title'].append(intern(title))
+        columns['rest'].append(intern(rest))
+        columns['start_date'].append(date(start_isodate))
+        columns['end_date'].append(date(end_isodate))
+        columns['weekday_start'].append(number(weekday_start_hour))
+        columns['weekday_end'].append(number(weekday_end_hour))
+        columns['weekend_hours'].append(number(hours))
+        columns['slot'].append(number(slot))
+    assert len(types) < 256, 'too many memory types'
+
+    type_ids = array.array('I', [intern(type) for type in types])
+    encoded = [s.encode('utf-8') for s in strings]
+    string_offsets = array.array('Q', [0])
+    for s in encoded:
+        string_offsets.append(string_offsets[-1] + len(s))
+
+    with open(fn_bgb, 'wb') as fp:
+        num_rows = len(columns['type'])
+        fp.write(BinaryBlueprint.header.pack(BinaryBlueprint.magic, BinaryBlueprint.version, num_rows, len(types), len(strings), string_offsets[-1]))
+        sections = [type_ids] + [columns[name] for name, _ in BinaryBlueprint.columns] + [string_offsets]
+        for section in sections:
+            fp.write(section.tobytes())
+            fp.write(bytes(-len(section.tobytes()) % 8))
+        fp.write(b''.join(encoded))
+    return num_rows
+
+def bgb_to_tsv(fn_bgb, fn_tsv):
+    '''Converts a binary blueprint.bgb back into a blueprint.tsv.
+    Returns the number of rows.'''
+
+    with BinaryBlueprint(fn_bgb) as blueprint, open(fn_tsv, 'w', encoding='utf-8') as fp:
+        fp.write('\t'.join(headers) + '\n')
+        for row in blueprint.tsv_rows():
+            fp.write('\t'.join(row) + '\n')
+        return blueprint.num_rows
+
+def compiled_blueprint(fn_py):
+    '''Returns where the records of a Python blueprint are cached as a binary blueprint: in its __pycache__,
+    keyed by the contents of both the blueprint and biograph.py, so that editing either misses the cache.'''
+
+    import hashlib
+    with open(fn_py, 'rb') as fp:
+        h = hashlib.sha256(fp.read())
+    h.update(source_digest())
+    h.update(b'%d' % BinaryBlueprint.version)
+
+    name = os.path.splitext(os.path.basename(fn_py))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(fn_py)), '__pycache__', '%s.%s.bgb' % (name, h.hexdigest()[:16]))
+
+def compile_blueprint(fn_bgb, rows):
+    'Caches the rows of a Python blueprint at fn_bgb, as given by compiled_blueprint(), dropping those of older versions.'
+
+    import glob
+    directory = os.path.dirname(fn_bgb)
+    name = os.path.basename(fn_bgb).rsplit('.', 2)[0]
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + '.' + '[0-9a-f]' * 16 + '.bgb')):
+            os.remove(stale)
+
+        # Written aside and moved into place, so that concurrent renders never read half a cache
+        fn_tmp = '%s.%d.tmp' % (fn_bgb, os.getpid())
+        rows_to_bgb(rows, fn_tmp)
+        os.replace(fn_tmp, fn_bgb)
+    except OSError as e:
+        print('blueprint cache: %s' % e, file=sys.stderr)
+
+## Render service
+class RenderCache:
+    '''Least recently used cache of rendered svgs, keyed by a hash of the blueprint and its options.
+    Evicts the oldest entries once there are more than max_entries, or they hold more than max_bytes.'''
+
+    def __init__(self, max_entries=256, max_bytes=64<<20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    @staticmethod
+    def key(blueprint, options):
+        'Returns the content address of a blueprint (bytes) drawn with options (dict).'
+
+        import json
+        import hashlib
+        h = hashlib.sha256(blueprint)
+        h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            svg = self.entries.get(key)
+            if svg is None:
+                self.counters['misses'] += 1
+            else:
+                self.counters['hits'] += 1
+                self.entries.move_to_end(key)
+            return svg
+
+    def put(self, key, svg):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = svg
+            self.num_bytes += len(svg)
+            while self.entries and (len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.num_bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def time(self, name, seconds):
+        'Adds a latency sample of seconds to the counters of name.'
+
+        with self.lock:
+            self.counters[name + '_count'] += 1
+            self.counters[name + '_seconds'] += seconds
+            self.counters[name + '_max_seconds'] = max(self.counters[name + '_max_seconds'], seconds)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries), bytes=self.num_bytes, max_entries=self.max_entries, max_bytes=self.max_bytes)
+        for name in ['hit', 'miss', 'failure']:
+            if stats.get(name + '_count'):
+                stats[name + '_mean_seconds'] = stats[name + '_seconds'] / stats[name + '_count']
+        return stats
+
+def render_tsv(blueprint, options=None):
+    '''Draws a blueprint.tsv (bytes) with options (dict of timeline_options) overriding the defaults.
+    Returns the svg as bytes.'''
+
+    bio = Biograph()
+    for k, v in (options or {}).items():
+        assert k in bio.timeline_options, k
+        bio.timeline_options[k] = v
+    out = io.StringIO()
+    bio.setup_dwg(out, stream=True)
+    bio.tsv_to_svg(io.StringIO(blueprint.decode('utf-8')))
+    bio.dwg.save()
+    return out.getvalue().encode('utf-8')
+
+class RenderHandler:
+    '''POST a blueprint.tsv to / to get its biograph.svg back; query parameters override timeline_options (e.g. /?legend=0).
+    GET /stats returns the cache hit/miss and latency counters as json; misses whose blueprint fails to draw are timed as failures.
+    serve() mixes it into an http.server.BaseHTTPRequestHandler, so that http.server is only imported to serve.'''
+
+    cache = None # set by serve()
+
+    def do_GET(self):
+        import json
+        import urllib.parse
+        if urllib.parse.urlsplit(self.path).path != '/stats':
+            return self.send_error(404)
+        self.reply(200, 'application/json', json.dumps(self.cache.stats(), indent=1).encode('utf-8'))
+
+    def do_POST(self):
+        import urllib.parse
+        start = time.perf_counter()
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        blueprint = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            # Bad options are turned away before the cache counts anything
+            options = {k: int(v[-1]) for k, v in query.items()}
+            for k in options:
+                assert k in timeline_options, 'no such option "%s"' % k
+        except Exception as e:
+            return self.reply(400, 'text/plain', ('%s: %s\n' % (e.__class__.__name__, e)).encode('utf-8'))
+
+        key = self.cache.key(blueprint, options)
+        svg = self.cache.get(key)
+        hit = svg is not None
+        if not hit:
+            try:
+                svg = render_tsv(blueprint, options)
+            except Exception as e:
+                # Counted among the misses, but timed apart from the renders that worked
+                self.cache.time('failure', time.perf_counter() - start)
+                return self.reply(400, 'text/plain', ('%s: %s\n' % (e.__class__.__name__, e)).encode('utf-8'))
+            self.cache.put(key, svg)
+
+        self.cache.time('hit' if hit else 'miss', time.perf_counter() - start)
+        self.reply(200, 'image/svg+xml', svg, ETag='"%s"' % key)
+
+    def reply(self, code, content_type, body, **headers):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if default_biograph.options.debug:
+            super().log_message(format, *args)
+
+def serve(address, max_entries=256, max_bytes=64<<20):
+    'Serves biographs over http on address ([host:]port) until interrupted, one thread per request.'
+
+    import http.server
+    host, _, port = address.rpartition(':')
+    handler = type('RenderHandler', (RenderHandler, http.server.BaseHTTPRequestHandler), dict(cache=RenderCache(max_entries, max_bytes)))
+    server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+    print('serving biographs on http://%s:%s/' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+## Watching
+class IncrementalRender:
+    '''Redraws fn_svg from fn_tsv after every edit, reusing the svg fragment of each memory whose row did not change.
+    Fragments are keyed by the row and the colour, label and slot it is drawn with.
+    Editing an option or timespan row moves the whole grid, so everything is redrawn, as it is with declutter or cluster_events on.'''
+
+    def __init__(self, fn_tsv, fn_svg):
+        self.fn_tsv = fn_tsv
+        self.fn_svg = fn_svg
+        self.grid_key = None
+        self.fragments = {}
+
+    def start_grid(self, grid_rows):
+        'Draws the grid from scratch, forgetting all fragments.'
+
+        self.out = io.StringIO()
+        self.bio = Biograph()
+        self.bio.setup_dwg(self.out, stream=True)
+        for row in grid_rows:
+            self.bio.draw_row(*parse_memory(row.split('\t')))
+        if self.bio.dwg.fp is None:
+            self.bio.dwg.start()
+        self.head = self.pop()
+        self.fragments = {}
+
+    def pop(self):
+        'Returns everything drawn since the last pop().'
+
+        drawn = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return drawn
+
+    def render(self):
+        '''Redraws fn_svg.
+        Returns (number of memories drawn, number of memories reused).'''
+
+        with open(self.fn_tsv, encoding='utf-8') as fp:
+            rows = fp.read().split('\n')
+        assert rows[0].split('\t') == headers, rows[0]
+        rows = [row for row in rows[1:] if row]
+
+        # The grid only stays put if every option and timespan row comes before the memories
+        is_grid = [row.split('\t', 1)[0] in ['option', 'timespan'] for row in rows]
+        num_grid_rows = is_grid.index(False) if False in is_grid else len(rows)
+        import hashlib
+        grid_key = hashlib.sha256('\n'.join(rows[:num_grid_rows]).encode('utf-8')).hexdigest()
+        if any(is_grid[num_grid_rows:]):
+            grid_key = None
+        # Decluttered labels depend on every label before them, and clustered events on their neighbours, so nothing is reused
+        if grid_key is None or grid_key != self.grid_key or self.bio.options.declutter or self.bio.options.cluster_events:
+            self.start_grid(rows[:num_grid_rows])
+        self.grid_key = grid_key
+
+        # Colours depend on every home and event before, so they are assigned again in one cheap pass
+        self.bio.residence_colors.clear()
+        self.bio.event_colors.clear()
+        fragments = {}
+        body = []
+        num_drawn = 0
+        memories = [parse_memory(row.split('\t')) for row in rows[num_grid_rows:]]
+        if self.bio.options.pack_slots:
+            self.bio.pack_slots(memories)
+        for row, memory in zip(rows[num_grid_rows:], memories):
+            type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs = memory
+            kwargs.pop('title', None)
+            if type in ['option', 'timespan']:
+                self.bio.draw_row(type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs)
+                body.append(self.pop())
+                continue
+
+            color, label = self.bio.memory_color(type, intensity, label, **kwargs)
+            key = (row, color, label, kwargs.get('slot'))
+            fragment = self.fragments.get(key) if self.grid_key else None
+            if fragment is None:
+                self.bio.draw(type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+                fragment = self.pop()
+                num_drawn += 1
+            fragments[key] = fragment
+            body.append(fragment)
+        self.fragments = fragments
+        num_reused = len(body) - num_drawn
+        if self.bio.events:
+            self.bio.flush_events()
+            body.append(self.pop())
+
+        with open(self.fn_svg + '.tmp', 'w', encoding='utf-8') as fp:
+            fp.write(self.head)
+            fp.writelines(body)
+            fp.write('</svg>')
+        os.replace(self.fn_svg + '.tmp', self.fn_svg)
+        return num_drawn, num_reused
+
+def watch(fn_tsv, fn_svg, interval=0.2):
+    'Redraws fn_svg whenever fn_tsv changes, until interrupted.'
+
+    render = IncrementalRender(fn_tsv, fn_svg)
+    last_mtime = None
+    print('watching %s' % fn_tsv)
+    try:
+        while True:
+            mtime = os.stat(fn_tsv).st_mtime_ns
+            if mtime != last_mtime:
+                last_mtime = mtime
+                start = time.perf_counter()
+                try:
+                    num_drawn, num_reused = render.render()
+                    print('output to %s: %d memories drawn, %d reused in %.1fms' % (fn_svg, num_drawn, num_reused, (time.perf_counter() - start) * 1000))
+                except Exception as e:
+                    render.grid_key = None
+                    print('%s: %s: %s' % (fn_tsv, e.__class__.__name__, e), file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+## Collective histomaps
+def disjoint_cells(rectangles):
+    '''Splits overlapping (first bin, last bin, left column, right column) rectangles, the last bin and right column
+    excluded, into disjoint ones covering the same cells.'''
+
+    cells = []
+    columns = sorted({column for rectangle in rectangles for column in rectangle[2:]})
+    previous = []
+    for left, right in zip(columns, columns[1:]):
+        merged = []
+        for first, last in sorted((first, last) for first, last, l, r in rectangles if l <= left and right <= r):
+            if merged and first <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+
+        # Strips alike side by side make one rectangle
+        if merged and merged == [[first, last] for first, last, l, r in previous]:
+            previous = [(first, last, l, right) for first, last, l, r in previous]
+            cells[-len(previous):] = previous
+        else:
+            previous = [(first, last, left, right) for first, last in merged]
+            cells.extend(previous)
+    return cells
+
+class Histomap:
+    '''Counts, over many blueprints, how many people spent each stretch of the week on each type of memory.
+    Weekday memories cover their weekday_start to weekday_end hours, and weekend memories the first weekend_hours
+    of the weekend, in columns of 1/columns_per_hour hours; dates are binned every days_per_bin days.
+    A person's memories of a type are merged into disjoint rectangles, so that a person counts once per cell, and added
+    as the four corners of a 2-D difference array, so a memory costs the same however long it lasts, and memory use grows with the timespan but not with the number of blueprints (requires numpy).'''
+
+    types = [type for type in color_palette if type not in ['home', 'event', 'roommate']]
+    weekend_hours = 32          # Waking hours of a weekend, as wide as timespan() draws the weekends
+
+    def __init__(self, days_per_bin=7, columns_per_hour=2, batch_size=1<<16):
+        self.days_per_bin = days_per_bin
+        self.columns_per_hour = columns_per_hour
+        self.batch_size = batch_size
+        self.weekday_start_hour = default_timeline_options['weekday_start_hour']
+        self.weekday_columns = int((default_timeline_options['weekday_end_hour'] - self.weekday_start_hour) * columns_per_hour)
+        self.num_columns = self.weekday_columns + self.weekend_hours * columns_per_hour
+
+        self.start = self.end = None    # Day ordinals spanned by all blueprints
+        self.first_bin = 0
+        self.diff = None                # (type, bin, column) difference array of people
+        self.people = None              # bin difference array of people whose timespan covers the bin
+        self.memories = []              # (type, first bin, last bin, left column, right column) not added yet
+        self.spans = []                 # (start, end) of the blueprints not added yet
+        self.num_blueprints = 0
+        self.num_memories = 0
+
+    def add_blueprint(self, fn_tsv):
+        '''Adds the weekday and weekend memories of a blueprint.tsv, which needs a timespan.
+        A broken blueprint raises before any of its memories are added.'''
+
+        span = None
+        rows = []
+        for fields in read_tsv(fn_tsv):
+            type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours = fields[:8]
+            if type == 'timespan':
+                span = day_ordinal(start_isodate), day_ordinal(end_isodate)
+            elif type in self.types:
+                rows.append((type, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours))
+
+        # Input Quality
+        assert span and span[0] < span[1], 'blueprint without a timespan'
+
+        # A person counts once in a cell however many of their memories of a type cover it
+        rectangles = {}
+        for type, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours in rows:
+            start, end = day_ordinal(start_isodate), day_ordinal(end_isodate) if end_isodate else span[1]
+            if hours:
+                left, right = self.column(0, True), self.column(float(hours), True)
+            else:
+                left, right = self.column(float(weekday_start_hour), False), self.column(float(weekday_end_hour), False)
+            if left < right and start < end:
+                rectangles.setdefault(self.types.index(type), []).append(
+                    (start // self.days_per_bin, (end - 1) // self.days_per_bin + 1, left, right))
+
+        memories = [(type,) + cells for type in sorted(rectangles) for cells in disjoint_cells(rectangles[type])]
+        self.memories.extend(memories)
+        self.spans.append(span)
+        self.start = span[0] if self.start is None else min(self.start, span[0])
+        self.end = span[1] if self.end is None else max(self.end, span[1])
+        self.num_blueprints += 1
+        self.num_memories += len(rows)
+        if len(self.memories) >= self.batch_size:
+            self.flush()
+
+    def column(self, hour, weekend):
+        'Column of an hour of the week; weekends come after the weekday hours.'
+
+        if weekend:
+            return min(max(self.weekday_columns + round(hour * self.columns_per_hour), self.weekday_columns), self.num_columns)
+        return min(max(round((hour - self.weekday_start_hour) * self.columns_per_hour), 0), self.weekday_columns)
+
+    def reserve(self, first, last):
+        'Grows the difference arrays to take in the bins first to last, both included.'
+
+        import numpy as np
+        if self.diff is None:
+            self.first_bin = first
+            self.diff = np.zeros((len(self.types), last - first + 1, self.num_columns + 1), dtype=np.int32)
+            self.people = np.zeros(last - first + 1, dtype=np.int32)
+            return
+
+        before = max(0, self.first_bin - first)
+        after = max(0, last - (self.first_bin + self.people.size - 1))
+        if before or after:
+            self.diff = np.pad(self.diff, ((0, 0), (before, after), (0, 0)))
+            self.people = np.pad(self.people, (before, after))
+            self.first_bin -= before
+
+    def flush(self):
+        'Adds the memories and timespans taken in so far to the difference arrays, in a few vectorized passes.'
+
+        import numpy as np
+        if not self.spans:
+            return
+
+        span_start, span_end = np.array(self.spans, dtype=np.int64).T
+        span_first, span_last = span_start // self.days_per_bin, (span_end - 1) // self.days_per_bin + 1
+        if self.memories:
+            type, first, last, left, right = (np.array(column, dtype=np.int64) for column in zip(*self.memories))
+        else:
+            type, first, last, left, right = (np.zeros(0, dtype=np.int64) for _ in range(5))
+        self.reserve(int(min(span_first.min(), first.min(initial=span_first.min()))), int(max(span_last.max(), last.max(initial=span_last.max()))))
+
+        # Bins that each timespan covers
+        np.add.at(self.people, span_first - self.first_bin, 1)
+        np.add.at(self.people, span_last - self.first_bin, -1)
+
+        # Cells that each memory covers
+        first, last = first - self.first_bin, last - self.first_bin
+        for bins, columns, sign in [(first, left, 1), (first, right, -1), (last, left, -1), (last, right, 1)]:
+            np.add.at(self.diff, (type, bins, columns), sign)
+
+        self.memories = []
+        self.spans = []
+
+    def counts(self):
+        '''Returns (people, counts): how many people each bin spans, and how many of them spent
+        each (type, bin, column) on a memory of that type.'''
+
+        self.flush()
+        return self.people.cumsum()[:-1], self.diff.cumsum(axis=1).cumsum(axis=2)[:, :-1, :-1]
+
+    def draw(self, bio, levels=10, **kwargs):
+        '''Draws the histomap onto bio as a heatmap on the timespan() grid of all blueprints.
+        Each cell takes the colour of the type that most people spent it on, and the opacity of their
+        share of the people alive then, in levels steps. Runs of alike cells down a column become one box.
+        **kwargs: timeline options.'''
+
+        import numpy as np
+        assert self.num_blueprints, 'no blueprints'
+        people, counts = self.counts()
+
+        kwargs = dict(dict(legend=False), **kwargs)
+        bio.timespan(ordinal_isodate(self.start), ordinal_isodate(self.end), **kwargs)
+
+        # Cells alike are those with the same top type and opacity
+        top = counts.argmax(axis=0)
+        share = counts.max(axis=0) / np.maximum(people, 1)[:, None]
+        level = np.minimum(np.ceil(share * levels), levels).astype(np.int64)
+        key = np.where(level > 0, top * (levels + 1) + level, -1)
+        runs = np.ones(key.shape, dtype=bool)
+        runs[1:] = key[1:] != key[:-1]
+
+        # Coordinates
+        day = lambda bin: min(max((self.first_bin + bin) * self.days_per_bin, self.start), self.end)
+        y = lambda bin: bio.parse_date(ordinal_isodate(day(bin)))
+        weekend_hour_width = bio.options.weekday_hour_width * 365 / (7 * 260)
+        def x(column):
+            if column <= self.weekday_columns:
+                return bio.weekday_hour(self.weekday_start_hour + column / self.columns_per_hour)
+            return bio.weekday_right_grid + 1 + (column - self.weekday_columns) / self.columns_per_hour * weekend_hour_width
+
+        # Drawing
+        num_bins = key.shape[0]
+        for column in range(self.num_columns):
+            starts = np.flatnonzero(runs[:, column]).tolist()
+            for first, last in zip(starts, starts[1:] + [num_bins]):
+                k = int(key[first, column])
+                if k < 0:
+                    continue
+                css = dict()
+                add_class(css, color_palette[self.types[k // (levels + 1)]] + '2')
+                bio.rectangle(x(column), y(first), x(column + 1), y(last), opacity='%g' % ((k % (levels + 1)) / levels), **css)
+
+        # Key
+        for i, type in enumerate(t for t in self.types if counts[self.types.index(t)].any()):
+            css = dict()
+            add_class(css, color_palette[type] + '2')
+            key_y = bio.options.top_grid + 20 + 20*i
+            bio.rectangle(bio.options.left_grid + 20, key_y, bio.options.left_grid + 40, key_y + 14, **css)
+            bio.text(bio.options.left_grid + 45, key_y + 12, type)
+        bio.text(bio.options.left_grid + 20, bio.options.top_grid + 20 + 20*len(self.types) + 12, '%d people' % self.num_blueprints)
+
+def blueprint_files(pattern):
+    'Returns the blueprint.tsv files of a directory or glob pattern, sorted.'
+
+    import glob
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.tsv')
+    return sorted(glob.glob(pattern))
+
+def render_histomap(pattern, fn_svg, days_per_bin=7, thumbnail=None, compact=False):
+    '''Draws the collective histomap of every blueprint.tsv in the directory or glob pattern into fn_svg.
+    Blueprints are read one at a time, and broken ones are reported and left out.
+    Returns the number of failures.'''
+
+    histomap = Histomap(days_per_bin)
+    failures = 0
+    for fn_tsv in blueprint_files(pattern):
+        try:
+            histomap.add_blueprint(fn_tsv)
+        except Exception as e:
+            failures += 1
+            print('%s: %s: %s' % (fn_tsv, e.__class__.__name__, e), file=sys.stderr)
+
+    bio = Biograph()
+    bio.setup_dwg(fn_svg, thumbnail=thumbnail, compact=compact)
+    histomap.draw(bio)
+    bio.dwg.save()
+
+    print('histomap of %d/%d blueprints (%d memories) output to %s' % (histomap.num_blueprints, histomap.num_blueprints + failures, histomap.num_memories, fn_svg))
+    return failures
+
+
+## Queries
+class IntervalTree:
+    '''A static interval tree over closed [first, last] intervals of day ordinals, each with an item.
+    Intervals are sorted by first day over the leaves of a complete binary tree whose nodes keep the latest last day
+    below them, so a query bisects the intervals that start early enough and only descends into subtrees that
+    end late enough: O(log n + k) for k answers.'''
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[:2])
+        self.firsts = [first for first, last, item in intervals]
+        self.items = [item for first, last, item in intervals]
+
+        self.size = 1
+        while self.size < len(intervals):
+            self.size *= 2
+        self.latest = [-1] * (2 * self.size)
+        self.latest[self.size:self.size + len(intervals)] = [last for first, last, item in intervals]
+        for node in range(self.size - 1, 0, -1):
+            self.latest[node] = max(self.latest[2*node], self.latest[2*node + 1])
+
+    def __len__(self):
+        return len(self.items)
+
+    def overlap(self, first, last):
+        'Returns the items of all intervals that share a day with [first, last], in order of their first day.'
+
+        end = bisect.bisect_right(self.firsts, last)    # Only intervals before end start early enough
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= end or self.latest[node] < first:
+                continue
+            if node >= self.size:
+                found.append(self.items[lo])
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2*node + 1, mid, hi))
+            stack.append((2*node, lo, mid))
+        return found
+
+    def stab(self, day):
+        'Returns the items of all intervals that contain day.'
+
+        return self.overlap(day, day)
+
+class MemoryIndex:
+    '''Answers what was going on between two dates of a blueprint, given its rows (lists of blueprint.tsv fields,
+    as read_tsv() yields or Memory.fields() returns). Memories without an end date last until the end of the timespan.
+    Keeps an IntervalTree per memory type, so filtering by type does not cost a scan of the others.'''
+
+    def __init__(self, rows):
+        memories = collections.defaultdict(list)
+        top = None
+        for row in rows:
+            type, intensity, label, start_isodate, end_isodate = row[:5]
+            if type == 'timespan':
+                top = day_ordinal(end_isodate)
+            elif type != 'option':
+                memories[type].append((row, day_ordinal(start_isodate), end_isodate and day_ordinal(end_isodate)))
+
+        self.trees = {}
+        for type, intervals in memories.items():
+            self.trees[type] = IntervalTree((first, top if last == '' else last, row) for row, first, last in intervals)
+
+    def __len__(self):
+        return sum(len(tree) for tree in self.trees.values())
+
+    def query(self, start_isodate, end_isodate=None, types=None, intensities=None):
+        '''Returns the rows of the memories that overlap start_isodate to end_isodate (both included),
+        or that contain start_isodate if there is no end_isodate, sorted by start date.
+        types and intensities, if given, are collections of those to keep.'''
+
+        first = day_ordinal(start_isodate)
+        last = day_ordinal(end_isodate) if end_isodate else first
+        found = []
+        for type, tree in self.trees.items():
+            if types is None or type in types:
+                found.extend(tree.overlap(first, last))
+        if intensities is not None:
+            intensities = set(str(intensity) for intensity in intensities)
+            found = [row for row in found if row[1] in intensities]
+        return sorted(found, key=lambda row: day_ordinal(row[3]))
+
+def memory_index(fn):
+    'Returns the MemoryIndex of a blueprint.tsv or binary blueprint.bgb.'
+
+    if fn.endswith('.bgb'):
+        with BinaryBlueprint(fn) as blueprint:
+            return MemoryIndex(blueprint.tsv_rows())
+    return MemoryIndex(read_tsv(fn))
+
+
+## Profiling
+class Profiler:
+    '''Counts the calls to and the time spent in the drawing functions of a Biograph, and in the phases of drawing it:
+    ingest (reading blueprint rows), layout (drawing them, less ingest) and serialize (dwg.save()).
+    Times are inclusive, so a drawer's time also holds the pencil strokes it calls. generic() calls are split up by memory type.
+    If fn_pstats is given, the whole run is also profiled by cProfile and its stats dumped there by report().'''
+
+    drawers = ['parse_date', 'timespan', 'generic', 'draw', 'occurrence', 'weekday', 'sleepmate', 'weekend', 'residence',
+               'layout_memories', 'draw_layout', 'place_label', 'text', 'text_left', 'text_center', 'line', 'rectangle', 'box', 'dot']
+
+    def __init__(self, bio, fn_pstats=''):
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.phases = collections.Counter()
+        self.fn_pstats = fn_pstats
+
+        # Instance attributes shadow the methods, so every self.drawer() call inside the Biograph goes through the profiler
+        for name in self.drawers:
+            setattr(bio, name, self.instrument(name, getattr(bio, name)))
+        bio.draw_rows = self.instrument_rows(bio.draw_rows)
+
+        self.cprofile = None
+        if fn_pstats:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def instrument(self, name, func):
+        'Returns func, counting its calls and time under name.'
+
+        by_type = name == 'generic'
+
+        @functools.wraps(func)
+        def instrumented(*args, **kwargs):
+            key = 'generic:%s' % args[0] if by_type else name
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls[key] += 1
+                self.seconds[key] += time.perf_counter() - start
+
+        return instrumented
+
+    def instrument_rows(self, draw_rows):
+        'Returns draw_rows, timing how long it waits on its rows as the ingest phase.'
+
+        def timed(rows):
+            rows = iter(rows)
+            while True:
+                start = time.perf_counter()
+                row = next(rows, None)
+                self.phases['ingest'] += time.perf_counter() - start
+                if row is None:
+                    return
+                yield row
+
+        @functools.wraps(draw_rows)
+        def instrumented(rows, *args, **kwargs):
+            return draw_rows(timed(rows), *args, **kwargs)
+
+        return instrumented
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        'Times the body of a with statement as the phase name.'
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def report(self, fn_svg=None, file=sys.stderr):
+        '''Prints the time spent per phase and per drawing function, and the element counts and size of fn_svg.
+        Dumps the cProfile stats, if any.'''
+
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.fn_pstats)
+
+        phases = dict(self.phases)
+        if 'layout' in phases:
+            phases['layout'] -= phases.get('ingest', 0)
+        print('%-24s %10s' % ('phase', 'seconds'), file=file)
+        for name in ['setup', 'ingest', 'layout', 'serialize']:
+            if name in phases:
+                print('%-24s %10.4f' % (name, phases[name]), file=file)
+
+        print('\n%-24s %10s %10s %10s' % ('function', 'calls', 'seconds', 'us/call'), file=file)
+        for name, seconds in self.seconds.most_common():
+            print('%-24s %10d %10.4f %10.1f' % (name, self.calls[name], seconds, 1e6 * seconds / self.calls[name]), file=file)
+
+        if fn_svg and fn_svg.endswith('.svg') and os.path.isfile(fn_svg):
+            with open(fn_svg, 'rb') as fp:
+                svg = fp.read()
+            import re
+            elements = collections.Counter(re.findall(rb'<([A-Za-z][\w:-]*)', svg))
+            print('\n%s: %d bytes, %d elements (%s)' % (fn_svg, len(svg), sum(elements.values()),
+                  ', '.join('%s %d' % (tag.decode(), n) for tag, n in elements.most_common())), file=file)
+
+        if self.cprofile:
+            print('cProfile stats dumped to %s' % self.fn_pstats, file=file)
+
+
+## Command line
+def render_job(job):
+    '''Renders a single (fn_tsv, fn_svg, stream, vectorized) job of a batch.
+    Returns (fn_tsv, number of memories, error), so that one broken blueprint does not take down the batch.'''
+
+    try:
+        return job[0], Biograph().render_blueprint(*job), None
+    except Exception as e:
+        return job[0], 0, '%s: %s' % (e.__class__.__name__, e)
+
+def render_batch(pattern, outdir='', workers=None, stream=False, vectorized=False):
+    '''Draws every blueprint.tsv in the directory or glob pattern with a pool of worker processes.
+    Each blueprint.tsv becomes blueprint.svg in outdir, or next to the blueprint if outdir is not given.
+    Prints failures and a throughput summary; returns the number of failures.'''
+
+    import concurrent.futures
+    fns_tsv = blueprint_files(pattern)
+
+    jobs = []
+    for fn_tsv in fns_tsv:
+        fn_svg = os.path.splitext(fn_tsv)[0] + '.svg'
+        if outdir:
+            fn_svg = os.path.join(outdir, os.path.basename(fn_svg))
+        jobs.append((fn_tsv, fn_svg, stream, vectorized))
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+
+    start = time.perf_counter()
+    num_memories = 0
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for fn_tsv, n, error in pool.map(render_job, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))):
+            num_memories += n
+            if error:
+                failures += 1
+                print('%s: %s' % (fn_tsv, error), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    print('rendered %d/%d blueprints (%d memories) in %.2fs: %.1f files/s, %.0f memories/s' %
+          (len(jobs) - failures, len(jobs), num_memories, elapsed, len(jobs) / elapsed, num_memories / elapsed))
+    return failures
+
+def render_shard(job):
+    '''Draws one (grid rows, memories) shard of render_sharded(), whose memories come already coloured as
+    (type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs).
+    Returns the svg of the memories alone.'''
+
+    grid_rows, memories = job
+    out = io.StringIO()
+    bio = Biograph()
+    bio.setup_dwg(out, stream=True)
+    for row in grid_rows:
+        bio.draw_row(*row)
+    if bio.dwg.fp is None:
+        bio.dwg.start()
+    out.seek(0)
+    out.truncate()
+
+    for type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs in memories:
+        bio.draw(type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, **kwargs)
+    return out.getvalue()
+
+def render_sharded(fn_blueprint, fn_svg, workers=None, min_shard_size=1000):
+    '''Draws fn_svg based off of a single blueprint.tsv (or binary blueprint.bgb) with a pool of worker processes.
+    Colours and slots are assigned first, in one cheap pass; then runs of rows in blueprint order are drawn as
+    shards by render_shard(), and stitched back in that order, so that the svg is the same as drawn by one process.
+    Blueprints with options or timespans among their memories, or with declutter or cluster_events on, are drawn by one process.
+    Returns the number of rows.'''
+
+    if fn_blueprint.endswith('.bgb'):
+        with BinaryBlueprint(fn_blueprint) as blueprint:
+            rows = list(blueprint.rows())
+    else:
+        rows = [parse_memory(fields) for fields in read_tsv(fn_blueprint)]
+    is_grid = [row[0] in ['option', 'timespan'] for row in rows]
+    num_grid_rows = is_grid.index(False) if False in is_grid else len(rows)
+    grid_rows, memories = rows[:num_grid_rows], rows[num_grid_rows:]
+
+    out = io.StringIO()
+    bio = Biograph()
+    bio.setup_dwg(out, stream=True)
+    for row in grid_rows:
+        bio.draw_row(*row)
+
+    # Options and timespans among the memories move the grid, decluttered labels depend on every label before them,
+    # and clustered events on their neighbours
+    if any(is_grid[num_grid_rows:]) or bio.options.declutter or bio.options.cluster_events:
+        return Biograph().render_blueprint(fn_blueprint, fn_svg, stream=True)
+    if bio.dwg.fp is None:
+        bio.dwg.start()
+
+    # Colours depend on every home and event before, and slots on every memory
+    if bio.options.pack_slots:
+        bio.pack_slots(memories)
+    coloured = []
+    for type, intensity, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs in memories:
+        kwargs.pop('title', None)
+        color, label = bio.memory_color(type, intensity, label, **kwargs)
+        coloured.append((type, color, label, start_isodate, end_isodate, weekday_start_hour, weekday_end_hour, hours, kwargs))
+
+    import concurrent.futures
+    workers = workers or os.cpu_count() or 1
+    shard_size = max(min_shard_size, -(-len(coloured) // (4 * workers)))
+    jobs = [(grid_rows, coloured[i:i + shard_size]) for i in range(0, len(coloured), shard_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool, open(fn_svg, 'w', encoding='utf-8') as fp:
+        fp.write(out.getvalue())
+        for fragment in pool.map(render_shard, jobs):
+            fp.write(fragment)
+        fp.write('</svg>')
+    return len(rows)
 
 def collect_args(argv):
-    '''biograph.py -i <input.tsv> -o <output.svg>
-    OR someone.py -t -o <output.tsv>
-    OR someone.py -o <output.svg>'''
-
+    '''biograph.py -i <input.tsv or input.bgb> -o <output.svg>
+    OR biograph.py -i <input.tsv> -o <output.bgb>
+    OR biograph.py -i <input.bgb> -o <output.tsv>
+    OR biograph.py -i <directory or glob> [-o <output directory>] [-j <workers>]
+    OR biograph.py -j <workers> -i <input.tsv or input.bgb> -o <output.svg>
+    OR biograph.py --serve [host:]port
+    OR biograph.py --watch -i <input.tsv> -o <output.svg>
+    OR biograph.py -c -i <input.tsv> -o <output.svg or output.svgz>
+    OR biograph.py [-c] [--bundle] -i <input.tsv> -o <output.svg or output.html>
+    OR biograph.py [--size <width>[x<height>]] -i <input.tsv> -o <thumbnail.png>
+    OR biograph.py --tiles <years per tile> -i <input.tsv> -o <output directory>
+    OR biograph.py --histomap <days per bin> -i <directory or glob> -o <output.svg>
+    OR biograph.py --query <date> [<end date>] [--type <type> ...] [--intensity <intensity> ...] -i <input.tsv or input.bgb>
+    OR biograph.py --profile [<stats.pstats>] -i <input.tsv> -o <output.svg>
+    OR someone.py [--no-cache] -t -o <output.tsv>
+    OR someone.py [--no-cache] -o <output.svg>'''
+
+    import argparse
     parser = argparse.ArgumentParser(description='')
 
     parser.add_argument('-i', dest='input',  default='',    help='input file')
     parser.add_argument('-t', dest='tsv',    default=False, help='save to tsv', action='store_true')
     parser.add_argument('-o', dest='output', default='',    help='output file')
+    parser.add_argument('-j', dest='workers', default=None, help='number of worker processes for a directory or glob of blueprints, or for shards of a single one', type=int)
+    parser.add_argument('-s', dest='stream', default=False, help='stream svg elements to the output file as they are drawn', action='store_true')
+    parser.add_argument('--numpy', dest='vectorized', default=False, help='lay out memories in vectorized numpy passes', action='store_true')
+    parser.add_argument('--watch', dest='watch', default=False, help='keep redrawing the output whenever the input changes', action='store_true')
+    parser.add_argument('-c', dest='compact', default=False, help='write a smaller svg: rects, symbols and rounded coordinates (always on for .svgz)', action='store_true')
+    parser.add_argument('--size', dest='size', default='300', help='WIDTH or WIDTHxHEIGHT of a .png thumbnail output')
+    parser.add_argument('--tiles', dest='tiles', default=0, help='draw into the (-o) directory as tiles of this many years, with overviews', type=int)
+    parser.add_argument('--no-cache', dest='cache', default=True, help='run a Python blueprint even if its records are cached', action='store_false')
+    parser.add_argument('--histomap', dest='histomap', default=0, help='draw the collective histomap of a (-i) directory or glob of blueprints, in bins of this many days', type=int)
+    parser.add_argument('--query', dest='query', default=None, help='print the memories of the (-i) blueprint on a date, or between two dates', nargs='+', metavar='DATE')
+    parser.add_argument('--type', dest='types', default=None, help='only query memories of these types', nargs='+')
+    parser.add_argument('--intensity', dest='intensities', default=None, help='only query memories of these intensities', nargs='+')
+    parser.add_argument('--bundle', dest='bundle', default=False, help='inline the stylesheets into the svg (always on for .html)', action='store_true')
+    parser.add_argument('--grid-cache', dest='grid_cache', default=None, help='keep drawn grids in this directory (default ~/.cache/biograph), for other renders of the same timespan and options', nargs='?', const=os.path.join('~', '.cache', 'biograph'))
+    parser.add_argument('--profile', dest='profile', default=None, help='report time spent per phase and drawing function, and dump cProfile stats to the optional file', nargs='?', const='')
+    parser.add_argument('--serve', dest='serve', default='', help='serve biographs over http on [host:]port')
+    parser.add_argument('--cache-entries', dest='cache_entries', default=256, help='number of svgs the server keeps', type=int)
+    parser.add_argument('--cache-bytes', dest='cache_bytes', default=64<<20, help='total size of svgs the server keeps', type=int)
 
     return parser.parse_args()
 
+def thumbnail_size(size):
+    'Returns the (width, height) of a WIDTHxHEIGHT or WIDTH size; height is None if not given.'
+
+    width, _, height = size.partition('x')
+    return int(width), int(height) if height else None
+
 def make_bio(func, argv):
-    'If passed -t writes a blueprint.tsv. Otherwise, can be invoked to draw a biograph.svg.'
+    '''If passed -t writes a blueprint.tsv. Otherwise, can be invoked to draw a biograph.svg.
+    The records func() remembers are cached (see compiled_blueprint()) and replayed while the blueprint is unchanged.'''
 
     args = collect_args(argv)
+    if args.grid_cache:
+        grid_cache.directory = os.path.expanduser(args.grid_cache)
+    profiler = Profiler(default_biograph, args.profile) if args.profile is not None else None
+    phase = profiler.phase if profiler else (lambda name: contextlib.nullcontext())
 
-    # Allow convenient access of dictionary values (dict.key)
-    global options
-    options = TypedAttrDict(timeline_options)
+    # Unless --no-cache, the records of an unchanged blueprint are replayed rather than computed again
+    fn_py = func.__code__.co_filename
+    fn_bgb = compiled_blueprint(fn_py) if args.cache and os.path.isfile(fn_py) else None
+    cached = fn_bgb is not None and os.path.exists(fn_bgb)
 
     if args.tsv:
-        setup_dwg('')
-        func()
         fnout = args.output or (args.input + '.tsv')
-        print_to_tsv(fnout)
+        if cached:
+            with phase('serialize'):
+                bgb_to_tsv(fn_bgb, fnout)
+        else:
+            setup_dwg(io.StringIO(), stream=True)
+            with phase('layout'):
+                func()
+            with phase('serialize'):
+                print_to_tsv(fnout)
     else:
         fnout = args.output or (args.input + '.svg')
-        setup_dwg(fnout)
-        func()
-        dwg.save()
+        with phase('setup'):
+            setup_dwg(fnout, args.stream, thumbnail=thumbnail_size(args.size) if fnout.endswith('.png') else None, compact=args.compact or fnout.endswith('.svgz'))
+        with phase('layout'):
+            if cached:
+                # Slots were never packed when func() drew the blueprint, so neither are they when replaying it
+                bgb_to_svg(fn_bgb, pack=False)
+            else:
+                func()
+                default_biograph.flush_events()
+        with phase('serialize'):
+            default_biograph.dwg.save()
+
+    # Options that would not be read back as they were given, such as year_height=None, are not cached
+    replayable = lambda memory: isinstance(memory.start_isodate, (int, float)) and option_value(memory.label, memory.fields()[3]) == memory.start_isodate
+    if fn_bgb and not cached and all(replayable(memory) for memory in default_biograph.saved_memories if memory.type == 'option'):
+        compile_blueprint(fn_bgb, (memory.fields() for memory in default_biograph.saved_memories))
 
     print('output to %s' % fnout)
+    if profiler:
+        profiler.report(None if args.tsv else fnout)
 
 def main():
-    'Draws a (-o) biograph.svg based on a (-i) blueprint.tsv'
+    '''Draws a (-o) biograph.svg, or a biograph.png thumbnail, based on a (-i) blueprint.tsv or binary blueprint.bgb.
+    If -o is a .bgb or (from a .bgb) a .tsv, converts the blueprint instead.
+    If -i is a directory or glob, draws all of its blueprints into the (-o) directory.
+    With --histomap, draws one collective histomap of all of them instead.
+    With --bundle, or to a .html, inlines the stylesheets so that the output needs no other file.
+    With -j, draws a single blueprint in shards with that many worker processes.
+    With --query, prints the memories of a blueprint between two dates as blueprint.tsv rows.
+    With --tiles, draws the biograph as tiles into the (-o) directory.'''
 
     args = collect_args(sys.argv)
+    if args.grid_cache:
+        grid_cache.directory = os.path.expanduser(args.grid_cache)
+
+    if args.serve:
+        return serve(args.serve, args.cache_entries, args.cache_bytes)
 
-    # Allow convenient access of dictionary values (dict.key)
-    global options
-    options = TypedAttrDict(timeline_options)
+    if args.watch:
+        return watch(args.input, args.output or (args.input + '.svg'))
+
+    if args.query:
+        assert len(args.query) <= 2, 'query a date, or between two dates'
+        print('\t'.join(headers))
+        for row in memory_index(args.input).query(*args.query, types=args.types, intensities=args.intensities):
+            print('\t'.join(row))
+        return
+
+    if args.histomap:
+        fn_svg = args.output or 'histomap.svg'
+        sys.exit(1 if render_histomap(args.input, fn_svg, args.histomap, thumbnail_size(args.size) if fn_svg.endswith('.png') else None, args.compact or fn_svg.endswith('.svgz')) else 0)
+
+    if os.path.isdir(args.input) or any(c in args.input for c in '*?['):
+        sys.exit(1 if render_batch(args.input, args.output, args.workers, args.stream, args.vectorized) else 0)
+
+    if args.tiles:
+        manifest = default_biograph.render_tiles(args.input, args.output or (args.input + '.tiles'), args.tiles, vectorized=args.vectorized)
+        return print('%d tiles output to %s' % (sum(len(level['tiles']) for level in manifest['levels']), args.output or (args.input + '.tiles')))
+
+    if args.output.endswith('.bgb'):
+        return print('%d rows output to %s' % (tsv_to_bgb(args.input, args.output), args.output))
+    if args.input.endswith('.bgb') and args.output.endswith('.tsv'):
+        return print('%d rows output to %s' % (bgb_to_tsv(args.input, args.output), args.output))
+
+    fn_svg = args.output or (args.input + '.svg')
+    if args.bundle or fn_svg.endswith('.html'):
+        # Input Quality
+        assert not fn_svg.endswith('.png'), 'a .png thumbnail cannot be bundled'
+        return default_biograph.render_bundle(args.input, fn_svg, args.compact or fn_svg.endswith('.svgz'), args.vectorized)
+    if args.workers and fn_svg.endswith('.svg') and not args.compact:
+        return render_sharded(args.input, fn_svg, args.workers)
+
+    profiler = Profiler(default_biograph, args.profile) if args.profile is not None else None
+    phase = profiler.phase if profiler else (lambda name: contextlib.nullcontext())
+
+    with phase('setup'):
+        setup_dwg(fn_svg, args.stream, thumbnail=thumbnail_size(args.size) if fn_svg.endswith('.png') else None, compact=args.compact or fn_svg.endswith('.svgz'))
+    with phase('layout'):
+        if args.input.endswith('.bgb'):
+            bgb_to_svg(args.input, args.vectorized)
+        else:
+            tsv_to_svg(args.input, args.vectorized)
+    with phase('serialize'):
+        default_biograph.dwg.save()
 
-    setup_dwg(args.output or (args.input + '.svg'))
-    tsv_to_svg(args.input)
-    dwg.save()
+    if profiler:
+        profiler.report(fn_svg)
 
 if __name__ == '__main__':
     main()